@@ -0,0 +1,7 @@
+"""
+Package: benchmarks
+Performance benchmarks for the wishlist service
+
+These are not part of the test suite, run them as modules:
+  python -m benchmarks.http_load --help
+"""
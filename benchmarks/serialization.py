@@ -0,0 +1,187 @@
+"""
+Micro-benchmarks for model serialization and deserialization
+
+Times Wishlist.serialize/deserialize and Item.serialize/deserialize on lists
+of 1 to 10k items without a database, reporting the median and best time
+per call as JSON. Every run can be appended to a history file to track the
+numbers over time, and compared with a baseline report to flag cases that
+got slower than a threshold, which exits with status 1.
+
+  python -m benchmarks.serialization --output baseline.json
+  python -m benchmarks.serialization --baseline baseline.json \\
+      --history benchmarks/serialization-history.jsonl
+"""
+import sys
+import json
+import timeit
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import date, datetime, timezone
+
+SIZES = (1, 10, 100, 1000, 10000)
+
+
+######################################################################
+# CASES
+######################################################################
+def make_items(count):
+    """ Returns count unsaved Items with every field set """
+    from service.models import Item  # pylint: disable=import-outside-toplevel
+    return [
+        Item(
+            id=number, wishlist_id=1, name=f"item-{number}", category="books",
+            price=number % 500, in_stock=True, purchased=False, version=1,
+        )
+        for number in range(1, count + 1)
+    ]
+
+
+def make_wishlist(count):
+    """ Returns an unsaved Wishlist holding count Items """
+    from service.models import Wishlist  # pylint: disable=import-outside-toplevel
+    wishlist = Wishlist(
+        id=1, name="benchmark", type="public", user_id=1,
+        created_date=date(2022, 1, 1), version=1,
+    )
+    wishlist.items = make_items(count)
+    return wishlist
+
+
+def build_cases(sizes):
+    """ Returns the benchmark cases as {name: (callable, items per call)} """
+    from service.models import Item, Wishlist  # pylint: disable=import-outside-toplevel
+    cases = {}
+    for size in sizes:
+        wishlist = make_wishlist(size)
+        wishlist_data = wishlist.serialize()
+        items = list(wishlist.items)
+        items_data = [item.serialize() for item in items]
+
+        def wishlist_deserialize(data=wishlist_data):
+            Wishlist().deserialize(data)
+
+        def item_deserialize(data=items_data):
+            for item_data in data:
+                Item().deserialize(item_data)
+
+        cases[f"wishlist_serialize[{size}]"] = (wishlist.serialize, size)
+        cases[f"wishlist_deserialize[{size}]"] = (wishlist_deserialize, size)
+        cases[f"item_serialize[{size}]"] = (
+            lambda items=items: [item.serialize() for item in items], size
+        )
+        cases[f"item_deserialize[{size}]"] = (item_deserialize, size)
+    return cases
+
+
+######################################################################
+# TIMING
+######################################################################
+def measure(func, items, repeat=5, min_time=0.2):
+    """
+    Times a callable and returns its statistics in microseconds per call
+
+    The number of calls per sample is chosen like timeit's autorange so
+    every sample takes at least min_time seconds.
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2 if number < 1000 else 10
+    samples = [total / number * 1e6 for total in timer.repeat(repeat, number)]
+    median = statistics.median(samples)
+    return {
+        "calls": number,
+        "median_us": round(median, 3),
+        "min_us": round(min(samples), 3),
+        "stdev_us": round(statistics.stdev(samples), 3) if len(samples) > 1 else 0.0,
+        "per_item_ns": round(median * 1000 / items, 1),
+    }
+
+
+def compare(results, baseline, threshold):
+    """ Returns a description of every case whose median grew by more than threshold """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous and current["median_us"] > previous["median_us"] * (1 + threshold):
+            regressions.append(f"{name}: median_us {previous['median_us']} -> {current['median_us']}")
+    return regressions
+
+
+def git_revision():
+    """ Returns the commit being benchmarked, if this is a git checkout """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+######################################################################
+# MAIN
+######################################################################
+def parse_args(argv=None):
+    """ Parses the command line """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)),
+                        help="comma separated numbers of items")
+    parser.add_argument("--filter", help="only run the cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5, help="samples per case")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per sample")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--history", help="append the report as one JSON line to this file")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="fraction a case may slow down by before it is flagged")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Runs the benchmarks and returns the process exit status """
+    args = parse_args(argv)
+    import sqlalchemy  # pylint: disable=import-outside-toplevel
+
+    cases = build_cases([int(size) for size in args.sizes.split(",")])
+    results = {}
+    for name, (func, items) in cases.items():
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(func, items, args.repeat, args.min_time)
+        print(f"{name}: {json.dumps(results[name])}", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(json.dumps(report, indent=2) + "\n")
+    else:
+        print(json.dumps(report, indent=2))
+    if args.history:
+        with open(args.history, "a", encoding="utf-8") as history:
+            history.write(json.dumps(report) + "\n")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline:
+            previous = json.load(baseline)["results"]
+        regressions = compare(results, previous, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
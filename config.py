@@ -17,7 +17,55 @@ if 'VCAP_SERVICES' in os.environ:
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-SQLALCHEMY_POOL_SIZE = 2
+
+# Connection pool per worker process, sized so every worker thread can hold a
+# connection with some overflow for streamed responses holding theirs longer
+WORKER_THREADS = int(os.getenv("GUNICORN_THREADS", "1"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(max(2, WORKER_THREADS))))
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+}
+if not DATABASE_URI.startswith("sqlite"):  # SQLite does not use a queue pool
+    SQLALCHEMY_ENGINE_OPTIONS.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", str(DB_POOL_SIZE))),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    )
+
+# Check the schema version when the service starts, which costs one query
+SCHEMA_CHECK = os.getenv("SCHEMA_CHECK", "false").lower() in ("1", "true", "yes")
+
+# Read replicas for the GET routes, comma separated, and how many seconds a
+# replica that failed is left out before it is tried again
+DATABASE_READ_URI = [uri.strip() for uri in os.getenv("DATABASE_READ_URI", "").split(",") if uri.strip()]
+REPLICA_RETRY_AFTER = float(os.getenv("REPLICA_RETRY_AFTER", "30"))
+
+# Databases of shards 1..N, comma separated, DATABASE_URI is shard 0. Wishlists
+# are placed by user_id modulo the number of shards, which cannot change later
+DATABASE_SHARD_URI = [uri.strip() for uri in os.getenv("DATABASE_SHARD_URI", "").split(",") if uri.strip()]
+
+# Async driver URI of the ASGI entry point, derived from DATABASE_URI if unset
+ASYNC_DATABASE_URI = os.getenv("ASYNC_DATABASE_URI")
+
+# Keyset pagination for list endpoints
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+
+# Rows fetched per round-trip from the server-side cursor when streaming
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# Largest number of records accepted by one bulk create request
+BULK_SIZE_MAX = int(os.getenv("BULK_SIZE_MAX", "5000"))
+
+# Per-process cache of serialized wishlists and items, off unless CACHE_SIZE is set.
+# Each process only sees its own writes, so with several workers a read can be
+# up to CACHE_TTL seconds stale, 304 answers included
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", "0"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "10"))
+
+# Wishlists inserted per transaction by the NDJSON import
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
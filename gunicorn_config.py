@@ -0,0 +1,92 @@
+"""
+Gunicorn configuration for production
+
+  gunicorn --config gunicorn_config.py service:app
+
+Every setting comes from the environment so one image can be tuned per
+node. The app is preloaded in the master by default, except for gevent
+workers, so workers fork with the routes and models already imported; the
+hooks below make sure no database connection opened before the fork is
+ever shared by two processes, which would corrupt the pool.
+"""
+import os
+import sys
+import multiprocessing
+
+CPU_COUNT = multiprocessing.cpu_count()
+
+# sync: one request per process. gthread: threads share the process and its
+# connection pool. gevent: greenlets, which needs gevent and psycogreen.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+if worker_class == "gthread":
+    DEFAULT_WORKERS, DEFAULT_THREADS = CPU_COUNT + 1, 4
+elif worker_class == "gevent":
+    DEFAULT_WORKERS, DEFAULT_THREADS = CPU_COUNT + 1, 1
+else:
+    DEFAULT_WORKERS, DEFAULT_THREADS = 2 * CPU_COUNT + 1, 1
+
+workers = int(os.getenv("GUNICORN_WORKERS", os.getenv("WEB_CONCURRENCY", str(DEFAULT_WORKERS))))
+threads = int(os.getenv("GUNICORN_THREADS", str(DEFAULT_THREADS)))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+# config.py sizes the connection pool of each worker from its thread count
+os.environ.setdefault("GUNICORN_THREADS", str(threads))
+if worker_class == "gevent":
+    os.environ.setdefault("DB_POOL_SIZE", os.getenv("GUNICORN_GEVENT_POOL_SIZE", "10"))
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:{}".format(os.getenv("PORT", "8080")))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+
+# Recycle workers now and then, at different times, to bound memory growth
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", str(max_requests // 10)))
+
+# gevent patches threading when a worker starts, so a preloaded app would keep
+# the unpatched locks the master created while importing it
+DEFAULT_PRELOAD = "false" if worker_class == "gevent" else "true"
+preload_app = os.getenv("GUNICORN_PRELOAD", DEFAULT_PRELOAD).lower() in ("1", "true", "yes")
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+######################################################################
+# SERVER HOOKS
+######################################################################
+def _engines():
+    """ Returns the database engines if the app was loaded in this process """
+    if "service.models" not in sys.modules:
+        return []
+    return sys.modules["service.models"].all_engines()
+
+
+def when_ready(server):
+    """ Closes the connections the master opened while loading the app """
+    engines = _engines()
+    if engines:
+        server.log.info("Closing the database connections of the master")
+    for engine in engines:
+        engine.dispose()
+
+
+def post_fork(server, worker):
+    """ Gives the new worker a pool of its own """
+    for engine in _engines():
+        # close=False drops the inherited connections without closing the
+        # sockets, which still belong to the master
+        engine.dispose(close=False)
+    if worker_class == "gevent":
+        try:
+            from psycogreen.gevent import patch_psycopg  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            server.log.warning("psycogreen is not installed, database calls will block the worker")
+        else:
+            patch_psycopg()
+    server.log.info("Worker spawned (pid: %s)", worker.pid)
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """ Removes the metrics of a dead worker from the multiprocess directory """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+        multiprocess.mark_process_dead(worker.pid)
@@ -21,14 +21,16 @@ and SQL database
 import sys
 import logging
 from flask import Flask
+from service.json_encoder import JSONEncoder
 
 # Create Flask application
 app = Flask(__name__)
 app.config.from_object("config")
+app.json_encoder = JSONEncoder  # orjson when installed, byte-compatible output
 
 # Import the routes After the Flask app is created
 # pylint: disable=wrong-import-position, cyclic-import
-from service import routes, models, error_handlers
+from service import routes, models, error_handlers, commands, metrics
 
 # Set up logging for production
 print("Setting up logging for {}...".format(__name__))
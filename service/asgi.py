@@ -0,0 +1,450 @@
+"""
+Module: asgi
+
+ASGI entry point of the Wishlist service
+
+  gunicorn service.asgi:application -k uvicorn.workers.UvicornWorker
+
+The read endpoints, which spend most of their time waiting on the database,
+are served by async handlers on an asyncpg engine, so one worker interleaves
+as many of them as its connection pool allows. Every other request goes to
+the Flask app in a thread pool, so both modes expose exactly the same API.
+
+The async handlers run inside a Flask request context matched against the
+same URL rules, so they share the argument parsing, ETags, error handlers,
+cache and metrics of the routes they stand in for. With more than one
+shard every request goes to the Flask app, which routes it to its shard.
+"""
+import sys
+from io import BytesIO
+from asgiref.sync import async_to_sync, sync_to_async
+from flask import request, jsonify, make_response, abort
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError, InterfaceError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import joinedload
+from werkzeug.exceptions import HTTPException
+from service.models import Wishlist, Item, cache, replicas, shards
+from service import json_encoder, routes, status
+from . import app
+
+# Engine options that also apply to the async pool
+POOL_OPTIONS = ("pool_size", "max_overflow", "pool_timeout", "pool_recycle", "pool_pre_ping")
+
+# Errors of a read replica that send its reads to the primary, asyncpg raises
+# OSError itself when it cannot connect
+REPLICA_ERRORS = (OperationalError, InterfaceError, OSError)
+
+
+def async_database_uri(uri):
+    """ Returns the URI of the async driver for a database URI """
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if uri.startswith(prefix):
+            return "postgresql+asyncpg://" + uri[len(prefix):]
+    if uri.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + uri[len("sqlite://"):]
+    return uri
+
+
+class AsyncDatabase():
+    """ The async engines of a worker, created on first use in its event loop """
+
+    def __init__(self):
+        self.engines = {}
+
+    def get_engine(self, bind=None):
+        """ Returns the async engine of the primary or a replica bind """
+        if bind not in self.engines:
+            if bind is None:
+                uri = app.config.get("ASYNC_DATABASE_URI") or app.config["SQLALCHEMY_DATABASE_URI"]
+            else:
+                uri = app.config["SQLALCHEMY_BINDS"][bind]
+            options = app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+            self.engines[bind] = create_async_engine(
+                async_database_uri(uri),
+                **{name: options[name] for name in POOL_OPTIONS if name in options},
+            )
+        return self.engines[bind]
+
+    def session(self, bind=None):
+        """ Returns a new AsyncSession on the primary or a replica bind """
+        return AsyncSession(self.get_engine(bind), expire_on_commit=False)
+
+    async def dispose(self):
+        """ Closes every pooled connection """
+        engines, self.engines = self.engines, {}
+        for engine in engines.values():
+            await engine.dispose()
+
+
+database = AsyncDatabase()
+
+
+class StreamedResponse():
+    """ A response whose body chunks come from an async iterator """
+
+    def __init__(self, chunks, mimetype):
+        self.chunks = chunks
+        # the chunks as the body mark the Flask response as streamed for its hooks
+        self.response = app.response_class(chunks, status.HTTP_200_OK, mimetype=mimetype)
+
+
+######################################################################
+# ASYNC READS
+######################################################################
+async def find_version(session, wishlist_id):
+    """ Async Wishlist.find_version() """
+    payload = cache.get(("Wishlist", wishlist_id))
+    if payload is not None:
+        return payload["version"]
+    result = await session.execute(select(Wishlist.version).filter(Wishlist.id == wishlist_id))
+    return result.scalar()
+
+
+async def not_modified(session, wishlist_id, variant=""):
+    """ Async routes.not_modified() """
+    if not request.if_none_match:
+        return None
+    version = await find_version(session, wishlist_id)
+    return routes.not_modified_since(wishlist_id, version, variant)
+
+
+async def find_serialized(session, model, by_id):
+    """ Async find_serialized() that reads through the same cache """
+    key = (model.__name__, by_id)
+    payload = cache.get(key)
+    if payload is None:
+        if model is Wishlist:
+            result = await session.execute(
+                select(Wishlist).options(joinedload(Wishlist.items)).filter(Wishlist.id == by_id)
+            )
+            record = result.unique().scalars().first()
+        else:
+            record = await session.get(model, by_id)
+        if not record:
+            return None
+        payload = record.serialize()
+        cache.set(key, payload)
+    return payload
+
+
+async def find_fields(session, model, by_id, fields):
+    """ Async find_fields() """
+    statement = model.load_fields(select(model).filter(model.id == by_id), fields)
+    result = await session.execute(statement)
+    return result.scalars().first()
+
+
+def stream(session, statement, model, serialize, mimetype):
+    """ Streams a select like routes.stream_response() through a server-side cursor """
+    statement = statement.order_by(model.id).execution_options(
+        yield_per=app.config["STREAM_BATCH_SIZE"]
+    )
+
+    async def generate():
+        async with session:
+            result = await session.stream(statement)
+            if mimetype == routes.NDJSON:
+                async for record in result.scalars():
+                    yield json_encoder.dumps(serialize(record)) + "\n"
+                return
+            separator = "["
+            async for record in result.scalars():
+                yield separator + json_encoder.dumps(serialize(record))
+                separator = ","
+            yield "[]" if separator == "[" else "]"
+
+    return StreamedResponse(generate(), mimetype)
+
+
+async def list_wishlists(session):
+    """ Async routes.list_wishlists() """
+    statement, serialize = routes.wishlist_listing(
+        Wishlist.find_by_filters(query=select(Wishlist), **routes.get_wishlist_filters()),
+        routes.get_fields(Wishlist),
+    )
+    headers = {}
+    if "limit" in request.args or "cursor" in request.args:
+        limit = routes.get_page_limit()
+        after_id = routes.decode_cursor(request.args.get("cursor"))
+        result = await session.execute(Wishlist.keyset_query(statement, limit, after_id))
+        wishlists = result.scalars().all()
+        if len(wishlists) > limit:
+            wishlists = wishlists[:limit]
+            headers = routes.next_page_headers(routes.encode_cursor(wishlists[-1].id))
+    elif routes.stream_mimetype():
+        return stream(session, statement, Wishlist, serialize, routes.stream_mimetype())
+    else:
+        wishlists = (await session.execute(statement)).scalars().all()
+    results = [serialize(wishlist) for wishlist in wishlists]
+    return make_response(jsonify(results), status.HTTP_200_OK, headers)
+
+
+async def get_wishlists(session, wishlist_id):
+    """ Async routes.get_wishlists() """
+    fields = routes.get_fields(Wishlist)
+    include_items = routes.expand_items()
+    if fields is not None:
+        variant = routes.fields_variant(fields)
+    else:
+        variant = "" if include_items else "summary"
+    response = await not_modified(session, wishlist_id, variant)
+    if response:
+        return response
+
+    if fields is not None:
+        wishlist = await find_fields(session, Wishlist, wishlist_id, fields)
+        message = wishlist.serialize_fields(fields) if wishlist else None
+    elif include_items:
+        message = await find_serialized(session, Wishlist, wishlist_id)
+    else:
+        wishlist = await session.get(Wishlist, wishlist_id)
+        message = wishlist.serialize(include_items=False) if wishlist else None
+    if not message:
+        abort(status.HTTP_404_NOT_FOUND, f"Wishlist with id '{wishlist_id}' could not be found.")
+    version = wishlist.version if fields is not None else message["version"]
+
+    response = make_response(jsonify(message), status.HTTP_200_OK)
+    response.set_etag(routes.wishlist_etag(wishlist_id, version, variant))
+    return response
+
+
+async def list_items(session, wishlist_id):
+    """ Async routes.list_items() """
+    fields = routes.get_fields(Item)
+    statement, serialize = routes.item_listing(
+        select(Item).filter(Item.wishlist_id == wishlist_id), fields
+    )
+    if routes.stream_mimetype():
+        if await find_version(session, wishlist_id) is None:
+            abort(status.HTTP_404_NOT_FOUND, f"Wishlist with id '{wishlist_id}' could not be found.")
+        return stream(session, statement, Item, serialize, routes.stream_mimetype())
+
+    variant = "items" if fields is None else "items-" + routes.fields_variant(fields)
+    response = await not_modified(session, wishlist_id, variant)
+    if response:
+        return response
+
+    if fields is not None:
+        version = await find_version(session, wishlist_id)
+        items = None
+        if version is not None:
+            items = [serialize(item) for item in (await session.execute(statement)).scalars()]
+    else:
+        wishlist = await find_serialized(session, Wishlist, wishlist_id)
+        version, items = (wishlist["version"], wishlist["items"]) if wishlist else (None, None)
+    if items is None:
+        abort(status.HTTP_404_NOT_FOUND, f"Wishlist with id '{wishlist_id}' could not be found.")
+
+    response = make_response(jsonify(items), status.HTTP_200_OK)
+    response.set_etag(routes.wishlist_etag(wishlist_id, version, variant))
+    return response
+
+
+async def get_items(session, wishlist_id, item_id):  # pylint: disable=unused-argument
+    """ Async routes.get_items() """
+    fields = routes.get_fields(Item)
+    if fields is not None:
+        record = await find_fields(session, Item, item_id, fields)
+        item = record.serialize_fields(fields) if record else None
+        version, variant = (record.version if record else None), routes.fields_variant(fields)
+    else:
+        item = await find_serialized(session, Item, item_id)
+        version, variant = (item["version"] if item else None), ""
+    if not item:
+        abort(status.HTTP_404_NOT_FOUND, f"Wishlist with id '{item_id}' could not be found.")
+
+    response = make_response(jsonify(item), status.HTTP_200_OK)
+    response.set_etag(routes.item_etag(item_id, version, variant))
+    return response
+
+
+# Flask endpoints served by an async handler for GET requests
+ASYNC_VIEWS = {
+    "list_wishlists": list_wishlists,
+    "get_wishlists": get_wishlists,
+    "list_items": list_items,
+    "get_items": get_items,
+}
+
+
+######################################################################
+# ASGI APPLICATION
+######################################################################
+def build_environ(scope, body):
+    """ Returns the WSGI environ of an ASGI HTTP request with the given body stream """
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_PROTOCOL": "HTTP/" + scope["http_version"],
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        value = value.decode("latin1")
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+async def read_body(receive):
+    """ Returns the body of a request, None if the client went away first """
+    body = BytesIO()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body.write(message.get("body", b""))
+        if not message.get("more_body"):
+            body.seek(0)
+            return body
+
+
+def run_wsgi_app(environ, send):
+    """
+    Runs the Flask app on a request in a worker thread and sends the response
+
+    The worker inherits the context variables of the event loop, including
+    the app context init_db() pushed, which Flask would reuse for every
+    request. Each request gets an app context of its own instead, so that
+    requests never share g and the session ends with the request.
+    """
+    send = async_to_sync(send)
+    started = []
+
+    def start_response(status_line, headers, exc_info=None):
+        if exc_info and started:
+            raise exc_info[1].with_traceback(exc_info[2])
+        started[:] = [int(status_line.split(" ", 1)[0]), [
+            (name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers
+        ]]
+
+    def send_start():
+        send({"type": "http.response.start", "status": started[0], "headers": started[1]})
+        started.append(True)
+
+    with app.app_context():
+        chunks = app(environ, start_response)
+        try:
+            for chunk in chunks:
+                if len(started) == 2:
+                    send_start()
+                if chunk:
+                    send({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+    if len(started) == 2:
+        send_start()
+    send({"type": "http.response.body", "body": b""})
+
+
+async def application(scope, receive, send):
+    """
+    The ASGI application
+
+    Tasks inherit the app context init_db() pushed at import, so every
+    request pushes its own, like run_wsgi_app(), for a g of its own.
+    """
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+        with app.app_context(), app.request_context(build_environ(scope, BytesIO())):
+            view = None if shards.sharded else ASYNC_VIEWS.get(request.endpoint)
+            if view is not None:
+                response = await dispatch(view)
+                await send_response(response, send, scope["method"] == "HEAD")
+                return
+    body = await read_body(receive)
+    if body is not None:
+        await sync_to_async(run_wsgi_app, thread_sensitive=False)(build_environ(scope, body), send)
+
+
+async def dispatch(view):
+    """
+    Runs an async view like Flask runs a sync one, with its hooks and error handlers
+
+    The view reads from a replica when there are any, and runs again on the
+    primary if the replica fails, like routes.replica_reads().
+    """
+    replica = replicas.choose()
+    session = database.session(replica)
+    streaming = False
+    try:
+        response = app.preprocess_request()
+        if response is None:
+            try:
+                response = await view(session, **request.view_args)
+            except REPLICA_ERRORS as error:
+                if replica is None:
+                    raise
+                app.logger.warning("Read replica %s failed, using the primary: %s", replica, error)
+                replicas.mark_down(replica)
+                await session.close()
+                session = database.session()
+                response = await view(session, **request.view_args)
+            streaming = isinstance(response, StreamedResponse)
+    except HTTPException as error:
+        response = app.make_response(app.handle_user_exception(error))
+    except Exception as error:  # pylint: disable=broad-except
+        response = app.make_response(app.handle_exception(error))
+    finally:
+        if not streaming:  # a streamed response closes the session when done
+            await session.close()
+    if streaming:
+        app.process_response(response.response)
+        return response
+    return app.process_response(app.make_response(response))
+
+
+async def send_response(response, send, head=False):
+    """ Sends a Flask or streamed response to the ASGI server """
+    flask_response = response.response if isinstance(response, StreamedResponse) else response
+    await send({
+        "type": "http.response.start",
+        "status": flask_response.status_code,
+        "headers": [
+            (name.lower().encode("latin1"), value.encode("latin1"))
+            for name, value in flask_response.headers.to_wsgi_list()
+        ],
+    })
+    if head:
+        await send({"type": "http.response.body", "body": b""})
+        return
+    if isinstance(response, StreamedResponse):
+        try:
+            async for chunk in response.chunks:
+                await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+        finally:
+            await response.chunks.aclose()  # closes the session if the client went away
+            flask_response.close()  # runs the call_on_close() callbacks, like a WSGI server
+        await send({"type": "http.response.body", "body": b""})
+        return
+    await send({"type": "http.response.body", "body": flask_response.get_data()})
+
+
+async def lifespan(receive, send):
+    """ Answers the server's startup and shutdown events """
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await database.dispose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
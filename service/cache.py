@@ -0,0 +1,95 @@
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Module: cache
+
+An in-process LRU cache with a time to live for serialized resources
+
+Each worker process has its own cache so entries written by another
+worker are only noticed once they expire; the TTL bounds that staleness.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache():
+    """ A thread safe least recently used cache whose entries expire """
+
+    def __init__(self, maxsize=1024, ttl=10.0, clock=time.monotonic):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._clock = clock
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, maxsize, ttl):
+        """ Resizes the cache and sets a new time to live, dropping every entry """
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._entries.clear()
+
+    def get(self, key):
+        """ Returns the value stored under key or None if missing or expired """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self._clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """ Stores value under key, evicting the least recently used entry when full """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def evict(self, *keys):
+        """ Removes the entries stored under keys """
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def evict_where(self, predicate):
+        """ Removes every entry for which predicate(key, value) is true """
+        with self._lock:
+            for key in [k for k, (_, v) in self._entries.items() if predicate(k, v)]:
+                del self._entries[key]
+
+    def clear(self):
+        """ Removes every entry """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """ Returns the size and hit/miss counters of the cache """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,101 @@
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Module: commands
+
+Flask CLI commands for administering the Wishlist service
+"""
+import click
+from service.models import Wishlist, shards, shard_engine
+from service import exporter, migrations
+from . import app
+
+
+######################################################################
+# DATABASE SCHEMA
+######################################################################
+@app.cli.group("db")
+def database():
+    """Manages the database schema"""
+
+
+@database.command("upgrade")
+def upgrade_database():
+    """Creates the tables or upgrades them to the latest schema version on every shard"""
+    for shard, version, applied in migrations.upgrade_shards():
+        prefix = f"Shard {shard}: " if shards.sharded else ""
+        if version is None:
+            click.echo(f"{prefix}Created the database schema at version {migrations.SCHEMA_VERSION}")
+        elif applied:
+            click.echo(
+                f"{prefix}Upgraded the database schema from version {version} to {migrations.SCHEMA_VERSION}"
+            )
+        else:
+            click.echo(f"{prefix}The database schema is up to date at version {version}")
+
+
+@database.command("current")
+def current_database():
+    """Shows the schema version of the database on every shard"""
+    for shard in shards:
+        prefix = f"Shard {shard}: " if shards.sharded else ""
+        with shard_engine(shard).connect() as connection:
+            version = migrations.current_version(connection)
+        click.echo(f"{prefix}Database schema version: {version}, latest: {migrations.SCHEMA_VERSION}")
+
+
+######################################################################
+# IMPORT WISHLISTS
+######################################################################
+@app.cli.command("import-wishlists")
+@click.argument("source", type=click.File("rb"))
+@click.option("--batch-size", type=int, default=None, help="Wishlists per transaction")
+def import_wishlists(source, batch_size):
+    """Imports Wishlists with their items from an NDJSON file (- for stdin)"""
+    batch_size = batch_size or app.config["IMPORT_BATCH_SIZE"]
+    imported = 0
+    failed = 0
+    for report in Wishlist.bulk_import(source, batch_size):
+        if "error" in report:
+            failed += 1
+            click.echo(f"Error: {report}", err=True)
+        if "imported" in report:
+            imported = report["imported"]
+            click.echo(f"Imported {imported} wishlists")
+    click.echo(f"Done: {imported} wishlists imported, {failed} errors")
+
+
+######################################################################
+# EXPORT WISHLISTS
+######################################################################
+@app.cli.command("export-wishlists")
+@click.argument("output", type=click.File("wb"), default="-")
+@click.option("--format", "fmt", type=click.Choice(exporter.FORMATS), default="ndjson")
+@click.option("--gzip", "compress", is_flag=True, help="Compress the output with gzip")
+@click.option("--user-id", type=int, default=None, help="Only export this user's wishlists")
+@click.option("--created-from", type=click.DateTime(["%Y-%m-%d"]), default=None)
+@click.option("--created-to", type=click.DateTime(["%Y-%m-%d"]), default=None)
+def export_wishlists(output, fmt, compress, user_id, created_from, created_to):
+    """Exports Wishlists with their items as NDJSON or CSV (- for stdout)"""
+    query = Wishlist.find_by_filters(
+        user_id=user_id,
+        created_from=created_from.date() if created_from else None,
+        created_to=created_to.date() if created_to else None,
+    )
+    wishlists = Wishlist.stream(Wishlist.with_items(query), app.config["STREAM_BATCH_SIZE"])
+    chunks = exporter.export_wishlists(wishlists, fmt)
+    if compress:
+        chunks = exporter.gzip_chunks(chunks)
+    for chunk in chunks:
+        output.write(chunk if compress else chunk.encode("utf-8"))
@@ -15,7 +15,8 @@
 Module: error_handlers
 """
 from flask import jsonify
-from service.models import DataValidationError
+from sqlalchemy.orm.exc import StaleDataError
+from service.models import DataValidationError, db
 from . import app, status
 
 ######################################################################
@@ -66,6 +67,40 @@ def method_not_supported(error):
     )
 
 
+@app.errorhandler(StaleDataError)
+def concurrent_update(error):
+    """Handles a record changed by another request since it was read"""
+    db.session.rollback()
+    app.logger.warning(str(error))
+    return conflict("The resource was changed by another request, read it again and retry")
+
+
+@app.errorhandler(status.HTTP_409_CONFLICT)
+def conflict(error):
+    """Handles conflicting updates with 409_CONFLICT"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(status=status.HTTP_409_CONFLICT, error="Conflict", message=message),
+        status.HTTP_409_CONFLICT,
+    )
+
+
+@app.errorhandler(status.HTTP_412_PRECONDITION_FAILED)
+def precondition_failed(error):
+    """Handles stale If-Match preconditions with 412_PRECONDITION_FAILED"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_412_PRECONDITION_FAILED,
+            error="Precondition Failed",
+            message=message,
+        ),
+        status.HTTP_412_PRECONDITION_FAILED,
+    )
+
+
 @app.errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 def mediatype_not_supported(error):
     """Handles unsupported media requests with 415_UNSUPPORTED_MEDIA_TYPE"""
@@ -0,0 +1,77 @@
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Module: exporter
+
+Encodes Wishlists for bulk export one record at a time so that
+exports of any size run in constant memory
+"""
+import io
+import csv
+import zlib
+from service import json_encoder
+
+FORMATS = ("ndjson", "csv")
+
+CSV_COLUMNS = [
+    "wishlist_id", "wishlist_name", "type", "user_id", "created_date",
+    "item_id", "item_name", "category", "price", "in_stock", "purchased",
+]
+
+
+def export_wishlists(wishlists, fmt):
+    """
+    Yields the Wishlists encoded as text chunks
+
+    ndjson writes one Wishlist with its items per line, csv writes one row
+    per Item with the columns of its Wishlist (and one row for an empty one)
+    """
+    if fmt == "csv":
+        return _export_csv(wishlists)
+    return _export_ndjson(wishlists)
+
+
+def gzip_chunks(chunks):
+    """ Compresses text chunks into a gzip stream as they are produced """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _export_ndjson(wishlists):
+    for wishlist in wishlists:
+        yield json_encoder.dumps(wishlist.serialize()) + "\n"
+
+
+def _export_csv(wishlists):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for wishlist in wishlists:
+        data = wishlist.serialize()
+        head = [data["id"], data["name"], data["type"], data["user_id"], data["created_date"]]
+        for item in data["items"] or [None]:
+            if item is None:
+                writer.writerow(head + [""] * 6)
+            else:
+                writer.writerow(head + [
+                    item["id"], item["name"], item["category"],
+                    item["price"], item["in_stock"], item["purchased"],
+                ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
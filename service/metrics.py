@@ -0,0 +1,154 @@
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Module: metrics
+
+Prometheus instrumentation of the Wishlist service
+
+When PROMETHEUS_MULTIPROC_DIR is set every gunicorn worker writes its
+samples there and /metrics aggregates them, so a scrape reports the
+whole node no matter which worker answers it.
+"""
+import os
+import time
+from flask import g, request, has_request_context
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from service.models import db, cache
+from service.pool import pool_stats
+from . import app, status
+
+LABELS = ["endpoint", "method", "status"]
+
+REQUEST_COUNT = Counter(
+    "wishlist_http_requests_total", "HTTP requests handled", LABELS
+)
+REQUEST_LATENCY = Histogram(
+    "wishlist_http_request_duration_seconds", "Time to produce a response", LABELS,
+)
+RESPONSE_SIZE = Histogram(
+    "wishlist_http_response_size_bytes", "Size of response bodies with a known length",
+    LABELS, buckets=(100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000),
+)
+DB_QUERIES = Histogram(
+    "wishlist_db_queries_per_request", "SQL statements executed per request",
+    ["endpoint"], buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+DB_QUERY_TIME = Histogram(
+    "wishlist_db_query_duration_seconds_per_request", "Time spent in SQL per request",
+    ["endpoint"],
+)
+
+# Per worker totals that are summed over the live workers
+CACHE_EVENTS = Gauge(
+    "wishlist_cache_events", "Cache lookups by result", ["result"], multiprocess_mode="livesum"
+)
+POOL_CONNECTIONS = Gauge(
+    "wishlist_db_pool_connections", "Database connections by state", ["state"],
+    multiprocess_mode="livesum",
+)
+POOL_WAIT_TIME = Gauge(
+    "wishlist_db_pool_wait_seconds", "Total time spent waiting for a connection",
+    multiprocess_mode="livesum",
+)
+POOL_TIMEOUTS = Gauge(
+    "wishlist_db_pool_timeouts", "Connection checkouts that timed out",
+    multiprocess_mode="livesum",
+)
+
+# How often, in seconds, a worker refreshes its cache and pool gauges
+GAUGE_INTERVAL = 1.0
+_last_gauge_update = 0.0
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument,too-many-arguments
+    if has_request_context():
+        g.query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_query(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument,too-many-arguments
+    if has_request_context() and "query_start" in g:
+        g.query_count = g.get("query_count", 0) + 1
+        g.query_time = g.get("query_time", 0.0) + time.perf_counter() - g.pop("query_start")
+
+
+@app.before_request
+def _start_request():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    if "request_start" not in g:
+        return response
+    labels = (request.endpoint or "none", request.method, response.status_code)
+    if response.is_streamed:
+        # the body and its queries run after this returns, so the request
+        # is recorded once the server has sent all of it
+        request_globals = g._get_current_object()  # pylint: disable=protected-access
+        response.call_on_close(lambda: _observe(labels, request_globals, None))
+    else:
+        _observe(labels, g, response.content_length)
+    return response
+
+
+def _observe(labels, request_globals, content_length):
+    """ Records the metrics of a request whose response is complete """
+    endpoint = labels[0]
+    REQUEST_COUNT.labels(*labels).inc()
+    REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - request_globals.request_start)
+    if content_length is not None:
+        RESPONSE_SIZE.labels(*labels).observe(content_length)
+    DB_QUERIES.labels(endpoint).observe(request_globals.get("query_count", 0))
+    DB_QUERY_TIME.labels(endpoint).observe(request_globals.get("query_time", 0.0))
+    _update_gauges()
+
+
+def _update_gauges(force=False):
+    """ Copies the cache and pool counters of this worker into the gauges """
+    global _last_gauge_update  # pylint: disable=global-statement
+    now = time.monotonic()
+    if not force and now - _last_gauge_update < GAUGE_INTERVAL:
+        return
+    _last_gauge_update = now
+    stats = cache.stats()
+    CACHE_EVENTS.labels("hit").set(stats["hits"])
+    CACHE_EVENTS.labels("miss").set(stats["misses"])
+    stats = pool_stats(db.engine)
+    for state in ("checkedin", "checkedout", "overflow"):
+        if state in stats:
+            POOL_CONNECTIONS.labels(state).set(stats[state])
+    POOL_WAIT_TIME.set(stats.get("wait_time", 0.0))
+    POOL_TIMEOUTS.set(stats.get("timeouts", 0))
+
+
+######################################################################
+# PROMETHEUS METRICS
+######################################################################
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """ Returns the metrics of every worker in the Prometheus text format """
+    _update_gauges(force=True)
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), status.HTTP_200_OK, {"Content-Type": CONTENT_TYPE_LATEST}
@@ -0,0 +1,200 @@
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Module: migrations
+
+Schema management of the Wishlist service
+
+The schema is created and upgraded by `flask db upgrade`, never when the
+service starts. The schema_version table holds the version of the schema
+a database is at. db.create_all() builds the latest schema and stamps it
+with SCHEMA_VERSION, and every later change to an existing table is a
+migration below that upgrades a database from the version before it.
+
+Version 1 is the schema of the service before it had migrations, so a
+database without a schema_version table is upgraded from there. Releases
+before the versions were renumbered stamped newer schemas as version 1
+or 2, so every migration checks what the database already has and only
+makes the changes that are missing.
+
+Every shard is a database of its own and is upgraded on its own.
+"""
+import logging
+from sqlalchemy import Table, Column, Integer, event, exc, inspect
+from service.models import db, shards, shard_engine
+
+logger = logging.getLogger("flask.app")
+
+schema_version = Table(
+    "schema_version", db.metadata,
+    Column("version", Integer, nullable=False),
+)
+
+
+def add_column(table, column, definition):
+    """ Returns a step that adds a column unless the table already has it """
+    def step(connection):
+        if column not in {info["name"] for info in inspect(connection).get_columns(table)}:
+            connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+
+def cascade_item_wishlist_id(connection):
+    """ Makes the database delete the items of a deleted wishlist """
+    if connection.dialect.name != "postgresql":
+        return  # SQLite cannot alter a constraint and only enforces it with PRAGMA foreign_keys
+    for foreign_key in inspect(connection).get_foreign_keys("item"):
+        if foreign_key["referred_table"] != "wishlist":
+            continue
+        if foreign_key["options"].get("ondelete", "").upper() != "CASCADE":
+            name = foreign_key["name"]
+            connection.exec_driver_sql(
+                f'ALTER TABLE item DROP CONSTRAINT "{name}", ADD CONSTRAINT "{name}" '
+                "FOREIGN KEY (wishlist_id) REFERENCES wishlist (id) ON DELETE CASCADE"
+            )
+
+
+def create_name_index(connection):
+    """ Indexes wishlist names for prefix searches """
+    # pattern ops let PostgreSQL use the index for prefix LIKE in any locale
+    ops = " varchar_pattern_ops" if connection.dialect.name == "postgresql" else ""
+    connection.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS ix_wishlist_name ON wishlist (name{ops})")
+
+
+# (version, steps) that upgrade a database from the version before, in order.
+# A step is an SQL statement or a function called with the connection.
+MIGRATIONS = [
+    # the items of a wishlist are deleted with it by ON DELETE CASCADE
+    (2, [cascade_item_wishlist_id]),
+    # indexes of the wishlist filters, keyset pages and item lookups
+    (3, [
+        "CREATE INDEX IF NOT EXISTS ix_item_wishlist_id ON item (wishlist_id)",
+        "CREATE INDEX IF NOT EXISTS ix_wishlist_user_id_id ON wishlist (user_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_wishlist_user_id_created_date ON wishlist (user_id, created_date)",
+        "CREATE INDEX IF NOT EXISTS ix_wishlist_created_date ON wishlist (created_date)",
+        create_name_index,
+    ]),
+    # the version of a wishlist, bumped whenever it or its items change
+    (4, [add_column("wishlist", "version", "INTEGER NOT NULL DEFAULT 1")]),
+    # the version of an item, checked by updates
+    (5, [add_column("item", "version", "INTEGER NOT NULL DEFAULT 1")]),
+    # item_count, total_price and purchased_count on wishlist, counted from the items
+    (6, [
+        add_column("wishlist", "item_count", "INTEGER NOT NULL DEFAULT 0"),
+        add_column("wishlist", "total_price", "INTEGER NOT NULL DEFAULT 0"),
+        add_column("wishlist", "purchased_count", "INTEGER NOT NULL DEFAULT 0"),
+        "UPDATE wishlist SET"
+        " item_count = (SELECT COUNT(*) FROM item WHERE item.wishlist_id = wishlist.id),"
+        " total_price = (SELECT COALESCE(SUM(price), 0) FROM item WHERE item.wishlist_id = wishlist.id),"
+        " purchased_count = (SELECT COUNT(*) FROM item WHERE item.wishlist_id = wishlist.id AND purchased)",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0] if MIGRATIONS else 1
+
+
+class SchemaVersionError(Exception):
+    """ Used when the database schema is not the one the service expects """
+
+
+@event.listens_for(schema_version, "after_create")
+def _stamp(target, connection, **kw):  # pylint: disable=unused-argument
+    """ A new database is created at the latest version """
+    connection.execute(target.insert().values(version=SCHEMA_VERSION))
+
+
+def current_version(connection):
+    """ Returns the schema version of a database, None if it has none """
+    if not inspect(connection).has_table(schema_version.name):
+        return None
+    return connection.execute(schema_version.select()).scalar()
+
+
+def upgrade(engine=None, shard=0):
+    """
+    Creates or upgrades the schema of a shard to SCHEMA_VERSION in one transaction
+
+    Returns the version the database was at, None if it had no tables, and
+    the versions of the migrations applied
+    """
+    engine = engine or shard_engine(shard)
+    with engine.begin() as connection:
+        tables = inspect(connection).get_table_names()
+        if schema_version.name not in tables and "wishlist" in tables:
+            # created by the service before its schema had a version, see above
+            schema_version.create(connection)
+            connection.execute(schema_version.update().values(version=1))
+        created = "wishlist" not in tables
+        db.metadata.create_all(connection)
+        version = current_version(connection)
+        applied = []
+        for number, steps in MIGRATIONS:
+            if number > version:
+                logger.info("Upgrading the database schema to version %d", number)
+                for step in steps:
+                    if callable(step):
+                        step(connection)
+                    else:
+                        connection.exec_driver_sql(step)
+                applied.append(number)
+        connection.execute(schema_version.update().values(version=SCHEMA_VERSION))
+        if shards.sharded and connection.dialect.name == "postgresql":
+            stride_sequences(connection, shard)
+    return (None if created else version), applied
+
+
+def upgrade_shards():
+    """ Upgrades every shard, returning (shard, version, applied) for each """
+    return [(shard, *upgrade(shard=shard)) for shard in shards]
+
+
+def stride_sequences(connection, shard):
+    """
+    Makes the id sequences of a shard hand out only the ids of that shard
+
+    Each sequence steps by the number of shards from the first id of the
+    shard after the ids already used, so ids stay unique across shards.
+    """
+    for table in ("wishlist", "item"):
+        sequence = connection.exec_driver_sql(
+            f"SELECT pg_get_serial_sequence('{table}', 'id')"
+        ).scalar()
+        last_value, is_called = connection.exec_driver_sql(
+            f"SELECT last_value, is_called FROM {sequence}"
+        ).first()
+        last_id = connection.exec_driver_sql(f"SELECT MAX(id) FROM {table}").scalar() or 0
+        last_id = max(last_id, last_value if is_called else last_value - 1)
+        connection.exec_driver_sql(
+            f"ALTER SEQUENCE {sequence} INCREMENT BY {shards.count} "
+            f"RESTART WITH {shards.next_id(shard, last_id)}"
+        )
+
+
+def check_schema(engine=None):
+    """ Raises SchemaVersionError unless the database, or every shard, is at SCHEMA_VERSION """
+    if engine is None:
+        return min(check_schema(shard_engine(shard)) for shard in shards)
+    with engine.connect() as connection:
+        try:
+            version = connection.execute(schema_version.select()).scalar()
+        except (exc.ProgrammingError, exc.OperationalError) as error:  # no schema_version table
+            raise SchemaVersionError(
+                "The database has no schema version, run 'flask db upgrade'"
+            ) from error
+    if version != SCHEMA_VERSION:
+        raise SchemaVersionError(
+            f"The database schema is at version {version}, the service needs "
+            f"{SCHEMA_VERSION}, run 'flask db upgrade'"
+        )
+    return version
@@ -3,14 +3,92 @@ Models for Wishlist
 
 All of the models are stored in this module
 """
+import json
+import heapq
 import logging
-from datetime import datetime
-from flask_sqlalchemy import SQLAlchemy
+import itertools
+from operator import attrgetter
+from datetime import date, datetime, timedelta
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import case, func, inspect, select
+from sqlalchemy.orm import (
+    Query, joinedload, selectinload, load_only, object_session, scoped_session, sessionmaker
+)
+from service.cache import LRUCache
+from service.pool import TimedQueuePool
+from service.replicas import ReplicaSet
+from service.shards import ShardMap, current_shard, use_shard
 
 logger = logging.getLogger("flask.app")
 
+
+class RoutingSession(SignallingSession):
+    """
+    A session on one shard that reads from the replica chosen for the request, if any
+
+    Writes, and every statement after a write in the same request, go to
+    the primary so that a request always reads what it wrote.
+    """
+
+    def __init__(self, db, autocommit=False, autoflush=True, **options):  # pylint: disable=redefined-outer-name
+        shard = current_shard.get()
+        if shard:
+            options["bind"] = shard_engine(shard)
+            options["binds"] = {}  # the tables of the primary are not on this shard
+        super().__init__(db, autocommit, autoflush, **options)
+        self.info["shard"] = shard
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get("read_replica") if has_request_context() else None
+        if replica is not None and not self._flushing and not g.get("wrote"):
+            return db.get_engine(self.app, bind=replica)
+        return super().get_bind(mapper, clause)
+
+
+class ShardScopedSession(scoped_session):
+    """
+    A scoped session per thread and shard
+
+    db.session is the session of the current shard. Records remember the
+    session they were loaded in, so their lazy loads and commits stay on
+    their shard whatever db.session is later. Removing or rolling back
+    db.session does so for every shard the thread used.
+    """
+
+    def _thread_sessions(self):
+        """ Returns the scope keys and sessions of the current thread """
+        ident = self.registry.scopefunc()[0]
+        return [(key, session) for key, session in list(self.registry.registry.items())
+                if key[0] == ident]
+
+    def remove(self):
+        for key, session in self._thread_sessions():
+            session.close()
+            self.registry.registry.pop(key, None)
+
+    def rollback(self):
+        for _, session in self._thread_sessions():
+            session.rollback()
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """ Flask-SQLAlchemy with sessions per shard that can read from a replica """
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_scoped_session(self, options=None):
+        session = super().create_scoped_session(options)
+        ident = session.registry.scopefunc
+        return ShardScopedSession(
+            session.session_factory, scopefunc=lambda: (ident(), current_shard.get())
+        )
+
+
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 class DataValidationError(Exception):
     """ Used for an data validation errors when deserializing """
@@ -18,6 +96,56 @@ class DataValidationError(Exception):
 
 DATETIME_FORMAT='%Y-%m-%d' # Note: updated date time format to match UI input field
 
+# Serialized Wishlists and Items keyed by (class name, id), sized in init_db()
+cache = LRUCache(maxsize=0)
+
+# Read replicas named after their SQLALCHEMY_BINDS keys, set in init_db()
+replicas = ReplicaSet()
+
+# The columns of a Wishlist that sum up its Items
+COUNTERS = ("item_count", "total_price", "purchased_count")
+
+# What /wishlists/<id>/summary returns, one row with no Items
+SUMMARY_FIELDS = ["id", "name", "user_id", *COUNTERS, "version"]
+
+# Engine binds of the read replicas
+REPLICA_BIND = "replica{}"
+
+# Shard 0 is the primary database, the others are engine binds
+shards = ShardMap()
+SHARD_BIND = "shard{}"
+
+
+def shard_engine(shard):
+    """ Returns the engine of a shard """
+    if shard == 0:
+        return db.engine
+    return db.get_engine(bind=SHARD_BIND.format(shard))
+
+
+def all_engines():
+    """ Returns the engines of the primary, the other shards and the replicas """
+    return [db.engine] + [
+        db.get_engine(bind=name) for name in (db.get_app().config.get("SQLALCHEMY_BINDS") or {})
+    ]
+
+
+def invalidate(keys):
+    """ Drops the cached payloads under keys along with the Items of any Wishlist """
+    cache.evict(*keys)
+    wishlist_ids = {by_id for name, by_id in keys if name == "Wishlist"}
+    if wishlist_ids:
+        # items can change with their wishlist, e.g. on a cascading delete
+        cache.evict_where(
+            lambda key, value: key[0] == "Item" and value["wishlist_id"] in wishlist_ids
+        )
+
+
+@db.event.listens_for(db.Model.metadata, "after_drop")
+def clear_cache(*args, **kwargs):  # pylint: disable=unused-argument
+    """ Empties the cache when the tables it mirrors are dropped """
+    cache.clear()
+
 ######################################################################
 #  P E R S I S T E N T   B A S E   M O D E L
 ######################################################################
@@ -30,43 +158,287 @@ class PersistentBase():
         """
         logger.info("Creating %s", self.name)
         self.id = None  # id must be none to generate next primary key
-        db.session.add(self)
-        db.session.commit()
+        with use_shard(self.shard()):
+            db.session.add(self)
+            self._commit()
 
     def update(self):
         """
         Updates a Account to the database
         """
         logger.info("Updating %s", self.name)
-        db.session.commit()
+        self._commit()
 
     def delete(self):
         """ Removes a Account from the data store """
         logger.info("Deleting %s", self.name)
-        db.session.delete(self)
-        db.session.commit()
+        session = object_session(self) or db.session
+        session.delete(self)
+        self._commit()
+
+    def _commit(self):
+        """ Commits the session of the record and drops the cached payloads it made stale """
+        session = object_session(self) or db.session
+        keys = self._cache_keys()
+        session.flush()  # assigns new ids and foreign keys
+        keys |= self._cache_keys()
+        session.commit()
+        invalidate(keys)
+
+    def shard(self):
+        """ Returns the number of the shard the record belongs on """
+        return shards.for_id(self.id)
+
+    def _cache_keys(self):
+        """ Returns the cache keys of the payloads a change to this record affects """
+        return {(type(self).__name__, self.id)}
+
+    @classmethod
+    def _bulk_created(cls, rows):
+        """ Called with the inserted rows before bulk_create commits """
+
+    @classmethod
+    def field_names(cls):
+        """ Returns the names of the fields a client can select """
+        return [column.key for column in cls.__table__.columns]
+
+    def serialize_fields(self, fields):
+        """ Serializes only the given fields of a record into a dictionary
+
+        Only the requested attributes are read, so a record loaded through
+        load_fields() serializes without going back to the database.
+
+        Args:
+            fields (list): the names of the fields to include
+        """
+        data = {}
+        for name in fields:
+            value = getattr(self, name)
+            if isinstance(value, date):
+                value = date.isoformat(value)
+            data[name] = value
+        return data
+
+    @classmethod
+    def find_serialized(cls, by_id):
+        """
+        Returns the serialized record with the given id or None
+
+        Payloads are read through the cache so repeated lookups
+        do not touch the database until a change invalidates them
+        """
+        key = (cls.__name__, by_id)
+        payload = cache.get(key)
+        if payload is None:
+            record = cls._find_to_serialize(by_id)
+            if not record:
+                return None
+            payload = record.serialize()
+            cache.set(key, payload)
+        return payload
+
+    @classmethod
+    def _find_to_serialize(cls, by_id):
+        """ Finds a record by it's ID with everything serialize() needs """
+        return cls.find(by_id)
+
+    @classmethod
+    def bulk_create(cls, records, commit=True):
+        """
+        Creates many records with one multi-row INSERT and a single commit
+
+        Unset columns fall back to their scalar defaults. The new ids are
+        copied back onto the records, which are not added to the session.
+        Pass commit=False to leave the INSERT in the current transaction.
+        """
+        logger.info("Bulk creating %s %s records", len(records), cls.__name__)
+        if not records:
+            return records
+        if shards.sharded:
+            for shard, group in cls._by_shard(records).items():
+                with use_shard(shard):
+                    cls._bulk_insert(group, commit)
+            return records
+        return cls._bulk_insert(records, commit)
+
+    @classmethod
+    def _by_shard(cls, records):
+        """ Groups records by the number of the shard they belong on """
+        groups = {}
+        for record in records:
+            groups.setdefault(record.shard(), []).append(record)
+        return groups
+
+    @classmethod
+    def _bulk_insert(cls, records, commit):
+        """ Inserts records into the current shard, see bulk_create() """
+        table = cls.__table__
+        rows = []
+        for record in records:
+            row = {}
+            for column in table.columns:
+                if column.primary_key:
+                    continue
+                value = getattr(record, column.key)
+                if value is None and column.default is not None and column.default.is_scalar:
+                    value = column.default.arg
+                row[column.key] = value
+            rows.append(row)
+        statement = table.insert().values(rows).returning(*table.columns)
+        results = db.session.execute(statement).fetchall()
+        cls._bulk_created(results)
+        if commit:
+            db.session.commit()
+        # PostgreSQL returns the rows of a multi-row VALUES in insertion order
+        keys = set()
+        for record, result in zip(records, results):
+            for column, value in zip(table.columns, result):
+                setattr(record, column.key, value)
+            keys |= record._cache_keys()  # pylint: disable=protected-access
+        invalidate(keys)
+        return records
 
     @classmethod
     def init_db(cls, app):
         """ Initializes the database session """
         logger.info("Initializing database")
         cls.app = app
+        cache.configure(app.config.get("CACHE_SIZE", 0), app.config.get("CACHE_TTL", 0))
+        options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+        if "pool_size" in options:
+            options.setdefault("poolclass", TimedQueuePool)
+        read_uris = app.config.get("DATABASE_READ_URI") or []
+        binds = {REPLICA_BIND.format(number): uri for number, uri in enumerate(read_uris)}
+        app.config["SQLALCHEMY_BINDS"] = {**(app.config.get("SQLALCHEMY_BINDS") or {}), **binds}
+        replicas.configure(binds, app.config.get("REPLICA_RETRY_AFTER", 30.0))
+        shard_uris = app.config.get("DATABASE_SHARD_URI") or []
+        if shard_uris and read_uris:
+            raise ValueError("DATABASE_READ_URI cannot be combined with DATABASE_SHARD_URI")
+        binds = {SHARD_BIND.format(number): uri for number, uri in enumerate(shard_uris, start=1)}
+        app.config["SQLALCHEMY_BINDS"].update(binds)
+        shards.configure(len(shard_uris) + 1)
         # This is where we initialize SQLAlchemy from the Flask app
+        # The engine connects on first use, the schema is managed by 'flask db upgrade'
         db.init_app(app)
         app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
 
     @classmethod
     def all(cls):
         """ Returns all of the records in the database """
         logger.info("Processing all records")
-        return cls.query.all()
+        return cls.fetch(cls.query)
 
     @classmethod
     def find(cls, by_id):
         """ Finds a record by it's ID """
         logger.info("Processing lookup for id %s ...", by_id)
-        return cls.query.get(by_id)
+        with use_shard(shards.for_id(by_id)):
+            return cls.query.get(by_id)
+
+    @classmethod
+    def find_fields(cls, by_id, fields):
+        """ Finds a record by it's ID loading only the columns of the given fields """
+        logger.info("Processing lookup of %s for id %s ...", fields, by_id)
+        with use_shard(shards.for_id(by_id)):
+            return cls.load_fields(cls.query.filter(cls.id == by_id), fields).first()
+
+    @classmethod
+    def on_shard(cls, query, shard):
+        """ Pins a query to one shard, e.g. when its filters select a single user """
+        if not shards.sharded:
+            return query
+        with use_shard(shard):
+            return query.with_session(db.session()).execution_options(shard=shard)
+
+    @classmethod
+    def shard_queries(cls, query):
+        """ Returns a copy of the query on every shard it has to run on """
+        if not shards.sharded:
+            return [query]
+        pinned = query.get_execution_options().get("shard")
+        if pinned is not None:
+            return [query]
+        queries = []
+        for shard in shards:
+            with use_shard(shard):
+                queries.append(query.with_session(db.session()))
+        return queries
+
+    @classmethod
+    def fetch(cls, query):
+        """ Returns every record a query finds on any shard, ordered by id if sharded
+
+        Args:
+            query (Query): the query to run
+        """
+        queries = cls.shard_queries(query)
+        if len(queries) == 1:
+            return queries[0].all()
+        return list(heapq.merge(
+            *(query.order_by(cls.id).all() for query in queries), key=attrgetter("id")
+        ))
+
+    @classmethod
+    def load_fields(cls, query, fields):
+        """ Restricts the columns a query loads to those of the given fields
+
+        The id and version are always loaded, they are needed to identify
+        the records and to tag responses with an ETag.
+
+        Args:
+            query (Query): the query to project
+            fields (list): the names of the fields that will be serialized
+        """
+        columns = [getattr(cls, name) for name in fields if name in cls.__table__.columns]
+        return query.options(load_only(cls.id, cls.version, *columns))
+
+    @classmethod
+    def keyset(cls, query, limit, after_id=None):
+        """ Returns the next page of a query ordered by id
+
+        Seeks past after_id using the primary key index instead of OFFSET,
+        so every page costs the same no matter how deep the client pages.
+        One extra row is fetched to tell if another page follows.
+
+        Args:
+            query (Query): the query to page through
+            limit (int): the maximum number of records to return
+            after_id (int): the id of the last record of the previous page
+
+        Returns:
+            (list, bool): the records and whether more records exist
+        """
+        logger.info("Processing page of %s after id %s ...", limit, after_id)
+        pages = [cls.keyset_query(query, limit, after_id).all() for query in cls.shard_queries(query)]
+        # every shard returns its own next page, the first of them merged are the page
+        records = list(itertools.islice(heapq.merge(*pages, key=attrgetter("id")), limit + 1))
+        return records[:limit], len(records) > limit
+
+    @classmethod
+    def keyset_query(cls, query, limit, after_id=None):
+        """ Restricts a query or select to the page keyset() returns plus one row """
+        if after_id is not None:
+            query = query.filter(cls.id > after_id)
+        return query.order_by(cls.id).limit(limit + 1)
+
+    @classmethod
+    def stream(cls, query, batch_size):
+        """ Iterates over a query ordered by id through a server-side cursor
+
+        Rows are fetched batch_size at a time so memory stays bounded
+        no matter how many records the query matches.
+
+        Args:
+            query (Query): the query to iterate over
+            batch_size (int): the number of rows to fetch per round-trip
+        """
+        logger.info("Processing streamed query in batches of %s", batch_size)
+        streams = [
+            query.order_by(cls.id).yield_per(batch_size) for query in cls.shard_queries(query)
+        ]
+        if len(streams) == 1:
+            return streams[0]
+        return heapq.merge(*streams, key=attrgetter("id"))
 
 
 ######################################################################
@@ -79,12 +451,17 @@ class Item(db.Model, PersistentBase):
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    wishlist_id = db.Column(db.Integer, db.ForeignKey('wishlist.id'), nullable=False)
+    wishlist_id = db.Column(
+        db.Integer, db.ForeignKey('wishlist.id', ondelete="CASCADE"), nullable=False, index=True
+    )
     name = db.Column(db.String(64)) # e.g., work, home, vacation, etc.
     category = db.Column(db.String(64))
     price = db.Column(db.Integer)
     in_stock = db.Column(db.Boolean, default=True)
     purchased = db.Column(db.Boolean, default=False)
+    # updates only apply to the version they were read at
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
     def __repr__(self):
         return "<Item %r id=[%s] wishlist[%s]>" % (self.name, self.id, self.wishlist_id)
@@ -92,6 +469,24 @@ class Item(db.Model, PersistentBase):
     def __str__(self):
         return "%s: %s, %s, %s %s" % (self.name, self.category, self.price, self.in_stock, self.purchased)
 
+    @classmethod
+    def _bulk_created(cls, rows):
+        changes = {}
+        for row in rows:
+            add_counts(changes, row.wishlist_id, row.price, row.purchased)
+        bump_versions(db.session, set(changes), changes)
+
+    def shard(self):
+        """ Items live on the shard of their Wishlist """
+        return shards.for_id(self.wishlist_id)
+
+    def _cache_keys(self):
+        """ Changing an Item also changes the Wishlists it moved between """
+        keys = {("Item", self.id), ("Wishlist", self.wishlist_id)}
+        for wishlist_id in inspect(self).attrs.wishlist_id.history.deleted or ():
+            keys.add(("Wishlist", wishlist_id))
+        return keys
+
     def serialize(self):
         """ Serializes a Item into a dictionary """
         return {
@@ -101,7 +496,8 @@ class Item(db.Model, PersistentBase):
             "category": self.category,
             "price": self.price,
             "in_stock": self.in_stock,
-            "purchased": self.purchased
+            "purchased": self.purchased,
+            "version": self.version,
         }
 
     def deserialize(self, data):
@@ -128,6 +524,59 @@ class Item(db.Model, PersistentBase):
             )
         return self
 
+    @classmethod
+    def purchase(cls, by_id):
+        """ Marks an Item purchased if it is in stock and not purchased yet
+
+        The check and the change are one conditional UPDATE, so concurrent
+        buyers can never both succeed, and the version of the Wishlist is
+        bumped by a second UPDATE in the same statement through a CTE.
+        NULL flags count as their column defaults, in stock and unpurchased.
+
+        Args:
+            by_id (int): the id of the Item to purchase
+
+        Returns:
+            Item: a detached copy of the purchased Item, or None if no Item
+            with that id is in stock and still unpurchased
+        """
+        logger.info("Processing purchase for id %s ...", by_id)
+        table = cls.__table__
+        wishlists = Wishlist.__table__
+        purchased = (
+            table.update()
+            .where(table.c.id == by_id, table.c.in_stock.isnot(False), table.c.purchased.isnot(True))
+            .values(purchased=True, version=table.c.version + 1)
+            .returning(*table.columns)
+            .cte("purchased")
+        )
+        bumped = (
+            wishlists.update()
+            .where(wishlists.c.id.in_(select(purchased.c.wishlist_id)))
+            .values(
+                version=wishlists.c.version + 1, purchased_count=wishlists.c.purchased_count + 1
+            )
+            .cte("bumped")
+        )
+        with use_shard(shards.for_id(by_id)):
+            row = db.session.execute(select(purchased).add_cte(bumped)).first()
+            db.session.commit()
+        if row is None:
+            return None
+        invalidate({("Item", row.id), ("Wishlist", row.wishlist_id)})
+        return cls(**row._mapping)
+
+    @classmethod
+    def find_by_wishlist(cls, wishlist_id):
+        """ Returns all Items in the given Wishlist
+
+        Args:
+            wishlist_id (int): the id of the Wishlist the Items belong to
+        """
+        logger.info("Processing items query for wishlist %s ...", wishlist_id)
+        query = cls.query.filter(cls.wishlist_id == wishlist_id)
+        return cls.on_shard(query, shards.for_id(wishlist_id))
+
 
 
 ######################################################################
@@ -140,29 +589,72 @@ class Wishlist(db.Model, PersistentBase):
 
     app = None
 
+    # Indexes backing find_by_filters and keyset pages ordered by id
+    __table_args__ = (
+        db.Index("ix_wishlist_user_id_id", "user_id", "id"),
+        db.Index("ix_wishlist_user_id_created_date", "user_id", "created_date"),
+        db.Index("ix_wishlist_created_date", "created_date"),
+        # pattern ops let PostgreSQL use the index for prefix LIKE in any locale
+        db.Index("ix_wishlist_name", "name", postgresql_ops={"name": "varchar_pattern_ops"}),
+    )
+
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64))
     type = db.Column(db.String(64))
     user_id = db.Column(db.Integer)
     created_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    items = db.relationship('Item', backref='wishlist', lazy=True)  
+    # kept up to date with the items in the same transaction, see bump_changed_versions
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    total_price = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    purchased_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # bumped whenever the wishlist or any of its items change
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    # updates only apply to the version they were read at, see bump_changed_versions
+    __mapper_args__ = {"version_id_col": version, "version_id_generator": False}
+    # the database deletes the items of a wishlist in the same statement
+    items = db.relationship(
+        'Item', backref='wishlist', lazy=True, cascade="all, delete", passive_deletes=True
+    )
 
     def __repr__(self):
         return "<Wishlist %r id=[%s]>" % (self.name, self.type, self.id)
 
-    def serialize(self):
-        """ Serializes a Wishlist into a dictionary """
+    def shard(self):
+        """ Wishlists live on the shard of their user """
+        return shards.for_user(self.user_id)
+
+    def update(self):
+        """
+        Updates a Wishlist in the database
+
+        A Wishlist cannot change to a user on another shard
+        """
+        if self.id is not None and shards.for_id(self.id) != self.shard():
+            (object_session(self) or db.session).rollback()
+            raise DataValidationError("Invalid Wishlist: user_id cannot move it to another shard")
+        super().update()
+
+    def serialize(self, include_items=True):
+        """ Serializes a Wishlist into a dictionary
+
+        Args:
+            include_items (bool): False leaves the items out of the summary
+        """
         wishlist = {
             "id": self.id,
             "name": self.name,
             "type": self.type,
             "user_id": self.user_id,
-            "created_date": self.created_date.strftime(DATETIME_FORMAT),
-            "items": []
+            # DATETIME_FORMAT without strftime, for dates and datetimes alike
+            "created_date": date.isoformat(self.created_date),
+            "item_count": self.item_count,
+            "total_price": self.total_price,
+            "purchased_count": self.purchased_count,
+            "version": self.version,
         }
-        for item in self.items:
-            wishlist['items'].append(item.serialize())
+        if include_items:
+            wishlist["items"] = [item.serialize() for item in self.items]
         return wishlist
 
     def deserialize(self, data):
@@ -201,3 +693,366 @@ class Wishlist(db.Model, PersistentBase):
         """
         logger.info("Processing name query for %s ...", name)
         return cls.query.filter(cls.name == name)
+
+    @classmethod
+    def delete_by_user(cls, user_id):
+        """ Removes every Wishlist of a user along with their Items
+
+        This is a single DELETE statement in one transaction, the Items
+        go with it through the ON DELETE CASCADE on Item.wishlist_id
+
+        Args:
+            user_id (int): the id of the user whose Wishlists are removed
+
+        Returns:
+            int: the number of Wishlists removed
+        """
+        logger.info("Deleting all wishlists for user %s", user_id)
+        with use_shard(shards.for_user(user_id)):
+            count = cls.query.filter(cls.user_id == user_id).delete(synchronize_session=False)
+            db.session.commit()
+        cache.clear()
+        return count
+
+    @classmethod
+    def bulk_import(cls, lines, batch_size):
+        """ Imports Wishlists and their Items from lines of NDJSON
+
+        Every line is validated with deserialize and the Wishlists are
+        loaded batch_size at a time, each batch with two multi-row INSERTs
+        in one transaction, so memory is bounded by the batch and not by
+        the size of the input.
+
+        Args:
+            lines (iterable): lines of JSON text or bytes, one Wishlist each
+            batch_size (int): the number of Wishlists to insert per transaction
+
+        Yields:
+            dict: an error for every line that could not be imported and
+            the running total after every batch
+        """
+        logger.info("Processing bulk import in batches of %s", batch_size)
+        imported = 0
+        batch = []
+        for number, line in enumerate(lines, start=1):
+            try:
+                if isinstance(line, bytes):
+                    line = line.decode("utf-8")
+                if not line.strip():
+                    continue
+                wishlist = cls().deserialize(json.loads(line))
+            except (ValueError, DataValidationError) as error:
+                yield {"line": number, "error": str(error)}
+                continue
+            batch.append((number, wishlist))
+            if len(batch) >= batch_size:
+                imported, report = cls._import_batch(batch, imported)
+                yield report
+                batch = []
+        if batch:
+            imported, report = cls._import_batch(batch, imported)
+            yield report
+
+    @classmethod
+    def _import_batch(cls, batch, imported):
+        """ Inserts a batch of numbered Wishlists and their Items in one transaction """
+        wishlists = [wishlist for _, wishlist in batch]
+        groups = cls._by_shard(wishlists)
+        try:
+            # insert on every shard before committing any, so that a shard
+            # refusing its rows leaves nothing of the batch on the others
+            for shard, group in groups.items():
+                with use_shard(shard):
+                    cls._bulk_insert(group, commit=False)
+                    items = []
+                    for wishlist in group:
+                        for item in wishlist.items:
+                            item.wishlist_id = wishlist.id
+                            items.append(item)
+                    if items:
+                        Item._bulk_insert(items, commit=False)  # pylint: disable=protected-access
+            for shard in groups:
+                with use_shard(shard):
+                    db.session.commit()
+        except SQLAlchemyError as error:
+            for shard in groups:
+                with use_shard(shard):
+                    db.session.rollback()
+            logger.error("Bulk import failed for lines %s-%s: %s", batch[0][0], batch[-1][0], error)
+            return imported, {
+                "lines": [batch[0][0], batch[-1][0]],
+                "error": str(getattr(error, "orig", None) or error),
+                "imported": imported,
+            }
+        imported += len(wishlists)
+        return imported, {"imported": imported}
+
+    @classmethod
+    def find_by_filters(
+        cls, user_id=None, type=None, name=None, name_prefix=None,
+        created_from=None, created_to=None, query=None
+    ):  # pylint: disable=redefined-builtin, too-many-arguments
+        """ Returns all Wishlists matching every filter that is given
+
+        Args:
+            user_id (int): the id of the user that owns the Wishlists
+            type (string): the type of the Wishlists
+            name (string): the exact name of the Wishlists
+            name_prefix (string): the start of the name of the Wishlists
+            created_from (date): the first day the Wishlists were created on
+            created_to (date): the last day the Wishlists were created on
+            query (Query): what to filter, e.g. an async select(), defaults to all Wishlists
+        """
+        logger.info(
+            "Processing filter query for user %s type %s name %s/%s* created %s to %s ...",
+            user_id, type, name, name_prefix, created_from, created_to
+        )
+        if query is None:
+            query = cls.query
+        if user_id is not None:
+            query = query.filter(cls.user_id == user_id)
+            if isinstance(query, Query):
+                query = cls.on_shard(query, shards.for_user(user_id))
+        if type is not None:
+            query = query.filter(cls.type == type)
+        if name is not None:
+            query = query.filter(cls.name == name)
+        if name_prefix is not None:
+            query = query.filter(cls.name.startswith(name_prefix, autoescape=True))
+        if created_from is not None:
+            query = query.filter(cls.created_date >= created_from)
+        if created_to is not None:
+            query = query.filter(cls.created_date < created_to + timedelta(days=1))
+        return query
+
+    @classmethod
+    def with_items(cls, query=None):
+        """ Loads the Items of every Wishlist in a query in one batch
+
+        The items relationship is lazy, so serializing a list of Wishlists
+        would otherwise issue one SELECT per Wishlist.
+
+        Args:
+            query (Query): the query to load items for, defaults to all Wishlists
+        """
+        if query is None:
+            query = cls.query
+        return query.options(selectinload(cls.items))
+
+    @classmethod
+    def _find_to_serialize(cls, by_id):
+        return cls.find_with_items(by_id)
+
+    @classmethod
+    def field_names(cls):
+        return super().field_names() + ["items"]
+
+    @classmethod
+    def load_fields(cls, query, fields):
+        query = super().load_fields(query, fields)
+        if "items" in fields:
+            query = cls.with_items(query)
+        return query
+
+    def serialize_fields(self, fields):
+        data = super().serialize_fields([name for name in fields if name != "items"])
+        if "items" in fields:
+            data["items"] = [item.serialize() for item in self.items]
+        return data
+
+    def columns_changed(self):
+        """ Returns True if any column other than the version has pending changes """
+        state = inspect(self)
+        return any(
+            state.attrs[attr.key].history.has_changes()
+            for attr in state.mapper.column_attrs if attr.key != "version"
+        )
+
+    @classmethod
+    def find_summary(cls, by_id):
+        """ Returns the counts and total price of a Wishlist without its Items, or None
+
+        Only the Wishlist row is read, or nothing when its payload is cached
+        """
+        logger.info("Processing summary lookup for id %s ...", by_id)
+        payload = cache.get((cls.__name__, by_id))
+        if payload is not None:
+            return {name: payload[name] for name in SUMMARY_FIELDS}
+        wishlist = cls.find_fields(by_id, SUMMARY_FIELDS)
+        return wishlist.serialize_fields(SUMMARY_FIELDS) if wishlist else None
+
+    @classmethod
+    def find_version(cls, by_id):
+        """ Returns the version of a Wishlist without loading it, or None """
+        logger.info("Processing version lookup for id %s ...", by_id)
+        payload = cache.get((cls.__name__, by_id))
+        if payload is not None:
+            return payload["version"]
+        with use_shard(shards.for_id(by_id)):
+            return db.session.query(cls.version).filter(cls.id == by_id).scalar()
+
+    @classmethod
+    def find_with_items(cls, by_id):
+        """ Finds a Wishlist by it's ID along with its Items """
+        logger.info("Processing lookup with items for id %s ...", by_id)
+        with use_shard(shards.for_id(by_id)):
+            return cls.query.options(joinedload(cls.items)).filter(cls.id == by_id).first()
+
+
+######################################################################
+#  R E A D   A F T E R   W R I T E
+######################################################################
+@db.event.listens_for(SignallingSession, "after_flush")
+def _flushed(session, flush_context):  # pylint: disable=unused-argument
+    """ Keeps the rest of the request on the primary once it wrote """
+    if has_request_context():
+        g.wrote = True
+
+
+@db.event.listens_for(SignallingSession, "do_orm_execute")
+def _executed(orm_execute_state):
+    """ Sends bulk statements, and what follows them, to the primary """
+    if has_request_context() and not orm_execute_state.is_select:
+        g.wrote = True
+
+
+######################################################################
+#  S H A R D E D   I D S
+######################################################################
+@db.event.listens_for(SignallingSession, "before_flush")
+def assign_shard_ids(session, flush_context, instances):  # pylint: disable=unused-argument
+    """
+    Gives new records the next id of their shard on databases without sequences
+
+    PostgreSQL shards stride their sequences, see migrations.upgrade(), so
+    this only applies to SQLite shards, which can only hand out MAX(id) + 1.
+    """
+    if not shards.sharded or session.get_bind().dialect.supports_sequences:
+        return
+    shard = session.info.get("shard", 0)
+    last_ids = {}
+    for model in (Wishlist, Item):  # wishlists first, their items need the ids
+        for record in [record for record in session.new if isinstance(record, model)]:
+            if record.id is not None:
+                continue
+            if model not in last_ids:
+                last_ids[model] = session.connection().execute(
+                    select(func.max(model.id))
+                ).scalar()
+            record.id = last_ids[model] = shards.next_id(shard, last_ids[model])
+
+
+######################################################################
+#  W I S H L I S T   V E R S I O N S
+######################################################################
+@db.event.listens_for(SignallingSession, "before_flush")
+def bump_changed_versions(session, flush_context, instances):  # pylint: disable=unused-argument
+    """
+    Bumps the version and counters of every Wishlist changed, or whose Items changed, in a flush
+
+    Wishlists whose own columns changed get the new version through the
+    ORM UPDATE, which also checks the version they were read at. The
+    others are bumped atomically so that adding Items never conflicts.
+    The item counts and total price are adjusted by the same UPDATE,
+    relative to the values in the database, so they never lose a change.
+    """
+    wishlist_ids = set()
+    skip_ids = set()
+    changes = {}
+    for record in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(record, Item):
+            wishlist_ids.add(record.wishlist_id)
+            wishlist_ids.update(inspect(record).attrs.wishlist_id.history.deleted or ())
+            parent = record.__dict__.get("wishlist")  # set when appended to wishlist.items
+            if parent is not None:
+                wishlist_ids.add(parent.id)
+            count_item_changes(record, session, changes)
+        elif isinstance(record, Wishlist):
+            if record in session.deleted:
+                skip_ids.add(record.id)
+            elif record in session.dirty and record.columns_changed():
+                record.version += 1
+                skip_ids.add(record.id)
+    for wishlist in [key for key in changes if isinstance(key, Wishlist)]:
+        # a new Wishlist is inserted with the counts of its new Items
+        items, price, purchased = changes.pop(wishlist)
+        wishlist.item_count = (wishlist.item_count or 0) + items
+        wishlist.total_price = (wishlist.total_price or 0) + price
+        wishlist.purchased_count = (wishlist.purchased_count or 0) + purchased
+    deleted_ids = {record.id for record in session.deleted if isinstance(record, Wishlist)}
+    for wishlist_id in deleted_ids:
+        changes.pop(wishlist_id, None)
+    bump_versions(session, wishlist_ids - skip_ids, changes)
+
+
+def count_item_changes(item, session, changes):
+    """ Adds what a new, changed or deleted Item does to the counters of its Wishlists """
+    if item not in session.new:
+        # take the Item out of the Wishlist it was in, as it was loaded
+        state = inspect(item)
+        wishlist_id, price, purchased = [
+            (history.deleted or history.unchanged or [None])[0]
+            for history in (state.attrs[key].load_history() for key in ("wishlist_id", "price", "purchased"))
+        ]
+        add_counts(changes, wishlist_id, price, purchased, -1)
+    if item not in session.deleted:
+        # an Item appended to wishlist.items is flushed into that Wishlist,
+        # whatever its wishlist_id says until then
+        added = inspect(item).attrs.wishlist.history.added
+        parent = added[0] if added else item.__dict__.get("wishlist")
+        if added and parent is not None:
+            wishlist = parent if parent in session.new else parent.id
+        else:
+            wishlist = item.wishlist_id if item.wishlist_id is not None else getattr(parent, "id", None)
+        add_counts(changes, wishlist, item.price, item.purchased)
+
+
+def add_counts(changes, wishlist, price, purchased, sign=1):
+    """ Adds an Item to, or with sign=-1 removes it from, the changes of a Wishlist """
+    if wishlist is None:
+        return
+    items, total, bought = changes.get(wishlist, (0, 0, 0))
+    changes[wishlist] = (
+        items + sign, total + sign * (price or 0), bought + (sign if purchased else 0)
+    )
+
+
+def bump_versions(session, wishlist_ids, changes=None):
+    """
+    Bumps the version of the Wishlists with the given ids in the current transaction
+
+    changes maps Wishlist ids to the (item_count, total_price, purchased_count)
+    to add to them, all in the same UPDATE
+    """
+    wishlist_ids = {wishlist_id for wishlist_id in wishlist_ids if wishlist_id is not None}
+    changes = {
+        wishlist_id: change for wishlist_id, change in (changes or {}).items()
+        if wishlist_id is not None and any(change)
+    }
+    all_ids = wishlist_ids | set(changes)
+    if not all_ids:
+        return
+    table = Wishlist.__table__
+    values = {}
+    changed = {wishlist_id: [] for wishlist_id in all_ids}
+    for index, column in enumerate(COUNTERS):
+        deltas = {wishlist_id: change[index] for wishlist_id, change in changes.items() if change[index]}
+        if deltas:
+            values[column] = table.c[column] + case(deltas, value=table.c.id, else_=0)
+            for wishlist_id in deltas:
+                changed[wishlist_id].append(column)
+    if wishlist_ids:
+        bump = 1 if wishlist_ids == all_ids else case(
+            {wishlist_id: 1 for wishlist_id in wishlist_ids}, value=table.c.id, else_=0
+        )
+        values["version"] = table.c.version + bump
+        for wishlist_id in wishlist_ids:
+            changed[wishlist_id].append("version")
+    session.connection().execute(
+        table.update().where(table.c.id.in_(all_ids)).values(values)
+    )
+    for wishlist_id, columns in changed.items():
+        wishlist = session.identity_map.get(session.identity_key(Wishlist, wishlist_id))
+        if wishlist is not None:
+            # reload the new values instead of checking against the old ones
+            session.expire(wishlist, columns)
@@ -0,0 +1,72 @@
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Module: replicas
+
+Round-robin choice of the read replica that serves a request
+
+A replica that fails is skipped for a while, its requests going to the
+primary database, and tried again once that time has passed.
+"""
+import time
+import threading
+
+
+class ReplicaSet():
+    """ A thread safe round-robin over the replicas that are not marked down """
+
+    def __init__(self, names=(), retry_after=30.0, clock=time.monotonic):
+        self._lock = threading.Lock()
+        self._clock = clock
+        self.names = []
+        self.retry_after = retry_after
+        self._next = 0
+        self._down_until = {}
+        self.failures = 0
+        self.configure(names, retry_after)
+
+    def configure(self, names, retry_after):
+        """ Sets the replicas and how many seconds a failed one is skipped for """
+        with self._lock:
+            self.names = list(names)
+            self.retry_after = retry_after
+            self._next = 0
+            self._down_until.clear()
+
+    def choose(self):
+        """ Returns the name of the next replica that is up, None to use the primary """
+        with self._lock:
+            now = self._clock()
+            for _ in range(len(self.names)):
+                name = self.names[self._next]
+                self._next = (self._next + 1) % len(self.names)
+                if self._down_until.get(name, now) <= now:
+                    return name
+            return None
+
+    def mark_down(self, name):
+        """ Skips a replica until retry_after seconds from now """
+        with self._lock:
+            self._down_until[name] = self._clock() + self.retry_after
+            self.failures += 1
+
+    def stats(self):
+        """ Returns the replicas, those marked down and the failure count """
+        with self._lock:
+            now = self._clock()
+            return {
+                "replicas": list(self.names),
+                "down": [name for name, until in self._down_until.items() if until > now],
+                "failures": self.failures,
+            }
@@ -19,13 +19,58 @@ This microservice handles the lifecycle of Wishlists
 """
 import os
 import sys
+import base64
+import binascii
 import logging
-from flask import jsonify, request, url_for, make_response, abort
+from datetime import datetime
+from functools import wraps
+from flask import jsonify, request, url_for, make_response, abort, g
+from flask import Response, stream_with_context
 from werkzeug.exceptions import NotFound
-from service.models import Wishlist, Item, DataValidationError
+from sqlalchemy.exc import OperationalError, InterfaceError
+from service.models import Wishlist, Item, DataValidationError, DATETIME_FORMAT, db, cache, replicas
+from service.pool import pool_stats
+from service import exporter, json_encoder, migrations
 from . import status  # HTTP Status Codes
 from . import app  # Import Flask application
 
+NDJSON = "application/x-ndjson"
+
+
+######################################################################
+# READ REPLICAS
+######################################################################
+def replica_reads(function):
+    """
+    Runs a read-only view against a read replica when there are any
+
+    The view runs again on the primary if the replica fails before the
+    response is returned, and the replica is left out for a while. A
+    streamed response that fails halfway cannot be retried.
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        replica = replicas.choose()
+        if replica is None:
+            return function(*args, **kwargs)
+        g.read_replica = replica
+        try:
+            return function(*args, **kwargs)
+        except (OperationalError, InterfaceError) as error:
+            app.logger.warning("Read replica %s failed, using the primary: %s", replica, error)
+            replicas.mark_down(replica)
+            db.session.rollback()
+            del g.read_replica
+            return function(*args, **kwargs)
+    return wrapper
+
+
+@app.teardown_request
+def end_replica_reads(error=None):  # pylint: disable=unused-argument
+    """ Forgets the replica and writes of the request """
+    g.pop("read_replica", None)
+    g.pop("wrote", None)
+
 
 ######################################################################
 # GET INDEX
@@ -45,40 +90,128 @@ def index():
     #     status.HTTP_200_OK,
     # )
 
+######################################################################
+# SERVICE STATISTICS
+######################################################################
+@app.route("/stats", methods=["GET"])
+def service_stats():
+    """ Returns live connection pool, cache and replica statistics for this worker """
+    return make_response(
+        jsonify(pool=pool_stats(db.engine), cache=cache.stats(), replicas=replicas.stats()),
+        status.HTTP_200_OK,
+    )
+
 # ######################################################################
 # # LIST ALL WISHLISTS
 # ######################################################################
 @app.route("/wishlists", methods=["GET"])
+@replica_reads
 def list_wishlists():
-    """ Returns all of the Wishlists """
+    """
+    Returns all of the Wishlists
+
+    The Wishlists can be filtered by any combination of user_id, type,
+    name, name_prefix and an inclusive created_from / created_to date range.
+
+    Passing a limit and/or cursor query parameter returns one page of results
+    ordered by id. The cursor for the next page is returned in the
+    X-Next-Cursor and Link headers and is absent on the last page.
+
+    Items are included unless an expand query parameter without "items"
+    is passed (e.g. expand=none), which returns summaries only.
+
+    Clients that accept application/x-ndjson, or pass stream=true, get the
+    results streamed one row at a time instead of in a single document.
+
+    A fields query parameter (e.g. fields=id,name) returns only those fields,
+    and only their columns are read. Items are included if "items" is one.
+    """
     app.logger.info("Request for Wishlist list")
     wishlists = []
-    name = request.args.get("name")
-    if name:
-        wishlists = Wishlist.find_by_name(name)
+    query, serialize = wishlist_listing(
+        Wishlist.find_by_filters(**get_wishlist_filters()), get_fields(Wishlist)
+    )
+
+    headers = {}
+    if "limit" in request.args or "cursor" in request.args:
+        limit = get_page_limit()
+        after_id = decode_cursor(request.args.get("cursor"))
+        wishlists, has_more = Wishlist.keyset(query, limit, after_id)
+        if has_more:
+            headers = next_page_headers(encode_cursor(wishlists[-1].id))
+    elif stream_mimetype():
+        wishlists = Wishlist.stream(query, app.config["STREAM_BATCH_SIZE"])
+        return stream_response(wishlists, serialize, stream_mimetype())
     else:
-        wishlists = Wishlist.all()
+        wishlists = Wishlist.fetch(query)
 
-    results = [wishlist.serialize() for wishlist in wishlists]
-    return make_response(jsonify(results), status.HTTP_200_OK)
+    results = [serialize(wishlist) for wishlist in wishlists]
+    return make_response(jsonify(results), status.HTTP_200_OK, headers)
 
 
 # ######################################################################
 # # RETRIEVE A WISHLIST
 # ######################################################################
 @app.route("/wishlists/<int:wishlist_id>", methods=["GET"])
+@replica_reads
 def get_wishlists(wishlist_id):
     """
     Retrieve a single Wishlist
 
     This endpoint will return an Wishlist based on it's id
+    It answers 304 Not Modified when If-None-Match holds its current ETag
     """
     app.logger.info("Request for Wishlist with id: %s", wishlist_id)
-    wishlist = Wishlist.find(wishlist_id)
-    if not wishlist:
+    fields = get_fields(Wishlist)
+    include_items = expand_items()
+    if fields is not None:
+        variant = fields_variant(fields)
+    else:
+        variant = "" if include_items else "summary"
+    response = not_modified(wishlist_id, variant)
+    if response:
+        return response
+
+    if fields is not None:
+        wishlist = Wishlist.find_fields(wishlist_id, fields)
+        message = wishlist.serialize_fields(fields) if wishlist else None
+        version = wishlist.version if wishlist else None
+    elif include_items:
+        message = Wishlist.find_serialized(wishlist_id)
+    else:
+        wishlist = Wishlist.find(wishlist_id)
+        message = wishlist.serialize(include_items=False) if wishlist else None
+    if not message:
         abort(status.HTTP_404_NOT_FOUND, f"Wishlist with id '{wishlist_id}' could not be found.")
+    if fields is None:
+        version = message["version"]
 
-    return make_response(jsonify(wishlist.serialize()), status.HTTP_200_OK)
+    response = make_response(jsonify(message), status.HTTP_200_OK)
+    response.set_etag(wishlist_etag(wishlist_id, version, variant))
+    return response
+
+
+######################################################################
+# RETRIEVE THE SUMMARY OF A WISHLIST
+######################################################################
+@app.route("/wishlists/<int:wishlist_id>/summary", methods=["GET"])
+@replica_reads
+def get_wishlist_summary(wishlist_id):
+    """
+    Retrieve the item count, total price and purchased count of a Wishlist
+
+    The counts are kept on the Wishlist, so no Items are read
+    """
+    app.logger.info("Request for the summary of Wishlist with id: %s", wishlist_id)
+    response = not_modified(wishlist_id, "counts")
+    if response:
+        return response
+    message = Wishlist.find_summary(wishlist_id)
+    if not message:
+        abort(status.HTTP_404_NOT_FOUND, f"Wishlist with id '{wishlist_id}' could not be found.")
+    response = make_response(jsonify(message), status.HTTP_200_OK)
+    response.set_etag(wishlist_etag(wishlist_id, message["version"], "counts"))
+    return response
 
 
 ######################################################################
@@ -101,6 +234,49 @@ def create_wishlists():
         jsonify(message), status.HTTP_201_CREATED, {"Location": location_url}
     )
 
+######################################################################
+# IMPORT WISHLISTS
+######################################################################
+@app.route("/wishlists/import", methods=["POST"])
+def import_wishlists():
+    """
+    Imports Wishlists in bulk
+    This endpoint reads one Wishlist with its items per line of an NDJSON body
+    and streams back an NDJSON report of bad lines and progress per batch
+    """
+    app.logger.info("Request to import Wishlists")
+    check_content_type(NDJSON)
+    reports = Wishlist.bulk_import(request.stream, app.config["IMPORT_BATCH_SIZE"])
+    return stream_response(reports, lambda report: report, NDJSON)
+
+######################################################################
+# EXPORT WISHLISTS
+######################################################################
+@app.route("/wishlists/export", methods=["GET"])
+def export_wishlists():
+    """
+    Exports Wishlists with their items
+    This endpoint streams every matching Wishlist as NDJSON or CSV (format),
+    optionally gzip compressed (gzip=true), with the same filters as
+    GET /wishlists
+    """
+    app.logger.info("Request to export Wishlists")
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in exporter.FORMATS:
+        abort(status.HTTP_400_BAD_REQUEST, f"format must be one of {', '.join(exporter.FORMATS)}")
+
+    query = Wishlist.with_items(Wishlist.find_by_filters(**get_wishlist_filters()))
+    wishlists = Wishlist.stream(query, app.config["STREAM_BATCH_SIZE"])
+    chunks = exporter.export_wishlists(wishlists, fmt)
+    headers = {"Content-Disposition": f"attachment; filename=wishlists.{fmt}"}
+    if request.args.get("gzip", "").lower() in ("1", "true"):
+        chunks = exporter.gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    mimetype = "text/csv" if fmt == "csv" else NDJSON
+    return Response(
+        stream_with_context(chunks), status.HTTP_200_OK, headers, mimetype=mimetype
+    )
+
 ######################################################################
 # UPDATE (EDIT) AN EXISTING WISHLIST
 ######################################################################
@@ -110,18 +286,23 @@ def update_wishlist(wishlist_id):
     Update a wishlist
 
     This endpoint will update a wishlist based the body that is posted
+    The update is rejected if If-Match or the version in the body is stale
     """
     app.logger.info("Request to update wishlist with id: %s", wishlist_id)
     check_content_type("application/json")
     wishlist = Wishlist.find(wishlist_id)
     if not wishlist:
         raise NotFound("Wishlist with id '{}' was not found.".format(wishlist_id))
-    wishlist.deserialize(request.get_json())
+    data = request.get_json()
+    check_version(wishlist_etag(wishlist_id, wishlist.version), wishlist.version, data)
+    wishlist.deserialize(data)
     wishlist.id = wishlist_id
     wishlist.update()
 
     app.logger.info("Wishlist with ID [%s] updated.", wishlist.id)
-    return make_response(jsonify(wishlist.serialize()), status.HTTP_200_OK)
+    response = make_response(jsonify(wishlist.serialize()), status.HTTP_200_OK)
+    response.set_etag(wishlist_etag(wishlist_id, wishlist.version))
+    return response
 
 ######################################################################
 # DELETE A WISHLIST
@@ -134,16 +315,29 @@ def delete_wishlists(wishlist_id):
     """
     app.logger.info("Request to delete wishlist with id: %s", wishlist_id)
     wishlist = Wishlist.find(wishlist_id)
-    
     if wishlist:
-         # new code to check if wishlist is empty
-        if wishlist.items:
-            for item in wishlist.items:
-                item.delete()
-            
+        # the items are removed by the database in the same transaction
         wishlist.delete()
     return make_response("", status.HTTP_204_NO_CONTENT)
 
+######################################################################
+# DELETE ALL WISHLISTS OF A USER
+######################################################################
+@app.route("/wishlists", methods=["DELETE"])
+def delete_user_wishlists():
+    """
+    Delete every Wishlist of a user
+    This endpoint will delete all Wishlists and their items for the user_id
+    passed in the query string in a single transaction
+    """
+    user_id = get_wishlist_filters().get("user_id")
+    if user_id is None:
+        abort(status.HTTP_400_BAD_REQUEST, "user_id is required to delete wishlists")
+    app.logger.info("Request to delete all wishlists for user: %s", user_id)
+    count = Wishlist.delete_by_user(user_id)
+    app.logger.info("Deleted %s wishlists for user %s", count, user_id)
+    return make_response("", status.HTTP_204_NO_CONTENT)
+
 #---------------------------------------------------------------------
 #                I T E M   M E T H O D S
 #---------------------------------------------------------------------
@@ -152,16 +346,40 @@ def delete_wishlists(wishlist_id):
 # LIST ITEMS
 ######################################################################
 @app.route("/wishlists/<int:wishlist_id>/items", methods=["GET"])
+@replica_reads
 def list_items(wishlist_id):
-    """ Returns all of the Itemes for an Wishlist """
-    app.logger.info("Request for all Itemes for Wishlist with id: %s", wishlist_id)
+    """
+    Returns all of the Itemes for an Wishlist
 
-    wishlist = Wishlist.find(wishlist_id)
-    if not wishlist:
+    A fields query parameter (e.g. fields=id,name) returns only those fields
+    """
+    app.logger.info("Request for all Itemes for Wishlist with id: %s", wishlist_id)
+    fields = get_fields(Item)
+    query, serialize = item_listing(Item.find_by_wishlist(wishlist_id), fields)
+
+    if stream_mimetype():
+        if not Wishlist.find(wishlist_id):
+            abort(status.HTTP_404_NOT_FOUND, f"Wishlist with id '{wishlist_id}' could not be found.")
+        items = Item.stream(query, app.config["STREAM_BATCH_SIZE"])
+        return stream_response(items, serialize, stream_mimetype())
+
+    variant = "items" if fields is None else "items-" + fields_variant(fields)
+    response = not_modified(wishlist_id, variant)
+    if response:
+        return response
+
+    if fields is not None:
+        version = Wishlist.find_version(wishlist_id)
+        items = [serialize(item) for item in Item.fetch(query)] if version is not None else None
+    else:
+        wishlist = Wishlist.find_serialized(wishlist_id)
+        version, items = (wishlist["version"], wishlist["items"]) if wishlist else (None, None)
+    if items is None:
         abort(status.HTTP_404_NOT_FOUND, f"Wishlist with id '{wishlist_id}' could not be found.")
 
-    results = [item.serialize() for item in wishlist.items]
-    return make_response(jsonify(results), status.HTTP_200_OK)
+    response = make_response(jsonify(items), status.HTTP_200_OK)
+    response.set_etag(wishlist_etag(wishlist_id, version, variant))
+    return response
 
 ######################################################################
 # ADD AN ITEM TO A WISHLIST
@@ -186,22 +404,81 @@ def create_items(wishlist_id):
     message = item.serialize()
     return make_response(jsonify(message), status.HTTP_201_CREATED)
 
+######################################################################
+# ADD MANY ITEMS TO A WISHLIST
+######################################################################
+@app.route('/wishlists/<int:wishlist_id>/items/bulk', methods=['POST'])
+def create_items_bulk(wishlist_id):
+    """
+    Create many Items on an Wishlist
+    This endpoint takes an array of items and inserts the valid ones in one
+    transaction. The response holds a result for every element in order.
+    """
+    app.logger.info("Request to bulk create Items for Wishlist with id: %s", wishlist_id)
+    check_content_type("application/json")
+
+    wishlist = Wishlist.find(wishlist_id)
+    if not wishlist:
+        abort(status.HTTP_404_NOT_FOUND, f"Wishlist with id '{wishlist_id}' could not be found.")
+
+    data = request.get_json()
+    if not isinstance(data, list):
+        abort(status.HTTP_400_BAD_REQUEST, "Request body must be an array of items")
+    if len(data) > app.config["BULK_SIZE_MAX"]:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"No more than {app.config['BULK_SIZE_MAX']} items can be created at once",
+        )
+
+    results = []
+    items = []
+    for index, json_item in enumerate(data):
+        try:
+            item = Item().deserialize(json_item)
+        except DataValidationError as error:
+            results.append(
+                {"index": index, "status": status.HTTP_400_BAD_REQUEST, "error": str(error)}
+            )
+            continue
+        item.wishlist_id = wishlist_id
+        items.append(item)
+        results.append({"index": index, "status": status.HTTP_201_CREATED, "item": item})
+
+    Item.bulk_create(items)
+    for result in results:
+        if "item" in result:
+            result["item"] = result["item"].serialize()
+
+    app.logger.info("Created %s of %s Items for Wishlist %s", len(items), len(data), wishlist_id)
+    if len(items) == len(data):
+        return make_response(jsonify(results), status.HTTP_201_CREATED)
+    return make_response(jsonify(results), status.HTTP_207_MULTI_STATUS)
+
 ######################################################################
 # RETRIEVE AN ITEM FROM A WISHLIST
 ######################################################################
 @app.route('/wishlists/<int:wishlist_id>/items/<int:item_id>', methods=['GET'])
+@replica_reads
 def get_items(wishlist_id, item_id):
     """
     Get an Item
     This endpoint returns just an item
     """
     app.logger.info("Request to retrieve Item %s for Wishlist id: %s", (item_id, wishlist_id))
-
-    item = Item.find(item_id)
+    fields = get_fields(Item)
+    if fields is not None:
+        record = Item.find_fields(item_id, fields)
+        item = record.serialize_fields(fields) if record else None
+        version, variant = (record.version if record else None), fields_variant(fields)
+    else:
+        item = Item.find_serialized(item_id)
+        version, variant = (item["version"] if item else None), ""
     if not item:
         abort(status.HTTP_404_NOT_FOUND, f"Wishlist with id '{item_id}' could not be found.")
 
-    return make_response(jsonify(item.serialize()), status.HTTP_200_OK)
+    response = make_response(jsonify(item), status.HTTP_200_OK)
+    response.set_etag(item_etag(item_id, version, variant))
+    return response
 
 ######################################################################
 # UPDATE AN ITEM
@@ -211,6 +488,7 @@ def update_items(wishlist_id, item_id):
     """
     Update an Item
     This endpoint will update an Item based the body that is posted
+    The update is rejected if If-Match or the version in the body is stale
     """
     app.logger.info("Request to update Item %s for Wishlist id: %s", (item_id, wishlist_id))
     check_content_type("application/json")
@@ -219,10 +497,14 @@ def update_items(wishlist_id, item_id):
     if not item:
         abort(status.HTTP_404_NOT_FOUND, f"Wishlist with id '{item_id}' could not be found.")
 
-    item.deserialize(request.get_json())
+    data = request.get_json()
+    check_version(item_etag(item_id, item.version), item.version, data)
+    item.deserialize(data)
     item.id = item_id
     item.update()
-    return make_response(jsonify(item.serialize()), status.HTTP_200_OK)
+    response = make_response(jsonify(item.serialize()), status.HTTP_200_OK)
+    response.set_etag(item_etag(item_id, item.version))
+    return response
 
 ######################################################################
 # DELETE AN ITEM
@@ -248,19 +530,19 @@ def delete_items(wishlist_id, item_id):
 
 @app.route("/wishlists/<int:wishlist_id>/items/<int:item_id>/purchase", methods=["PUT"])
 def purchase_items(wishlist_id, item_id):
-    """Endpoint to Purchase an item"""
+    """
+    Endpoint to Purchase an item
+    The item is purchased by a single conditional UPDATE, the item is only
+    read again to tell why when it could not be purchased
+    """
     app.logger.info("Request to Purchase item with id: %s", item_id)
 
-    item = Item.find(item_id)
+    item = Item.purchase(item_id)
     if not item:
-        abort(status.HTTP_404_NOT_FOUND, f"Item with id '{item_id}' was not found.")
-
-    if not item.in_stock:
+        if not Item.find(item_id):
+            abort(status.HTTP_404_NOT_FOUND, f"Item with id '{item_id}' was not found.")
         abort(status.HTTP_409_CONFLICT, f"Item with id '{item_id}' is not available.")
 
-    item.purchased = True
-    item.update()
-
     return make_response(jsonify(item.serialize()), status.HTTP_200_OK)
 
 ######################################################################
@@ -271,10 +553,199 @@ def init_db():
     """ Initializes the SQLAlchemy app """
     global app
     Wishlist.init_db(app)
+    if app.config["SCHEMA_CHECK"]:
+        migrations.check_schema()
 
 def check_content_type(content_type):
     """ Checks that the media type is correct """
     if request.headers["Content-Type"] == content_type:
         return
     app.logger.error("Invalid Content-Type: %s", request.headers["Content-Type"])
-    abort(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, f"Content-Type must be {content_type}")
\ No newline at end of file
+    abort(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, f"Content-Type must be {content_type}")
+
+def wishlist_etag(wishlist_id, version, variant=""):
+    """ Returns the strong ETag of a representation of a Wishlist version """
+    return f"{wishlist_id}-{version}-{variant}" if variant else f"{wishlist_id}-{version}"
+
+def item_etag(item_id, version, variant=""):
+    """ Returns the strong ETag of a representation of an Item version """
+    return f"{item_id}-{version}-{variant}" if variant else f"{item_id}-{version}"
+
+def check_version(etag, version, data):
+    """
+    Rejects an update made from a stale copy of a resource
+
+    A client can send the ETag it read in If-Match, which fails with
+    412 Precondition Failed, or the version it read in the body, which
+    fails with 409 Conflict. Writes that race past this check are caught
+    by the version check in the UPDATE itself.
+    """
+    if request.if_match:
+        if not request.if_match.contains(etag):
+            abort(status.HTTP_412_PRECONDITION_FAILED, "If-Match does not match the current version")
+    elif isinstance(data, dict) and data.get("version") not in (None, version):
+        abort(
+            status.HTTP_409_CONFLICT,
+            f"Version {data['version']} is stale, the current version is {version}",
+        )
+
+def not_modified(wishlist_id, variant=""):
+    """
+    Returns a 304 Not Modified response when the client's copy is current
+
+    Only the version of the Wishlist is read, so nothing is loaded or
+    serialized when the ETag in If-None-Match still matches
+    """
+    if not request.if_none_match:
+        return None
+    return not_modified_since(wishlist_id, Wishlist.find_version(wishlist_id), variant)
+
+def not_modified_since(wishlist_id, version, variant=""):
+    """ Returns a 304 Not Modified response if version is the client's copy """
+    if version is None:
+        return None
+    etag = wishlist_etag(wishlist_id, version, variant)
+    if not request.if_none_match.contains(etag):
+        return None
+    response = make_response("", status.HTTP_304_NOT_MODIFIED)
+    response.set_etag(etag)
+    return response
+
+def expand_items():
+    """ Returns True unless the client asked to leave the items out """
+    expand = request.args.get("expand")
+    if expand is None:
+        return True
+    return "items" in expand.split(",")
+
+def wishlist_listing(query, fields):
+    """
+    Applies the fields or expand parameters to a query of Wishlists
+
+    Returns the query and the function that serializes each Wishlist it finds
+    """
+    if fields is not None:
+        return (
+            Wishlist.load_fields(query, fields),
+            lambda wishlist: wishlist.serialize_fields(fields),
+        )
+    include_items = expand_items()
+    if include_items:
+        query = Wishlist.with_items(query)
+    return query, lambda wishlist: wishlist.serialize(include_items)
+
+def item_listing(query, fields):
+    """
+    Applies the fields parameter to a query of Items
+
+    Returns the query and the function that serializes each Item it finds
+    """
+    if fields is None:
+        return query, Item.serialize
+    return Item.load_fields(query, fields), lambda item: item.serialize_fields(fields)
+
+def get_fields(model):
+    """
+    Returns the fields the client selected with fields=, or None for all
+
+    The id is always included. Unknown field names are a bad request.
+    """
+    value = request.args.get("fields")
+    if value is None:
+        return None
+    fields = {name.strip() for name in value.split(",") if name.strip()}
+    unknown = fields - set(model.field_names())
+    if unknown:
+        abort(status.HTTP_400_BAD_REQUEST, f"Unknown fields: {', '.join(sorted(unknown))}")
+    fields.add("id")
+    return sorted(fields)
+
+def fields_variant(fields):
+    """ Returns the ETag variant of a representation restricted to fields """
+    return "fields-" + ".".join(fields)
+
+def stream_mimetype():
+    """ Returns the media type to stream the response in, or None """
+    if request.accept_mimetypes.best == NDJSON:
+        return NDJSON
+    if request.args.get("stream", "").lower() in ("1", "true"):
+        return "application/json"
+    return None
+
+def stream_response(records, serialize, mimetype):
+    """
+    Streams records to the client as they are read from the database
+
+    Each record is encoded on its own, so only one batch of rows is ever
+    held in memory and the first bytes go out before the query completes.
+    """
+
+    def generate():
+        if mimetype == NDJSON:
+            for record in records:
+                yield json_encoder.dumps(serialize(record)) + "\n"
+            return
+        separator = "["
+        for record in records:
+            yield separator + json_encoder.dumps(serialize(record))
+            separator = ","
+        yield "[]" if separator == "[" else "]"
+
+    return Response(stream_with_context(generate()), status.HTTP_200_OK, mimetype=mimetype)
+
+def get_wishlist_filters():
+    """ Returns the Wishlist filters passed in the query string """
+    filters = {}
+    for name in ("type", "name", "name_prefix"):
+        value = request.args.get(name)
+        if value:
+            filters[name] = value
+    user_id = request.args.get("user_id")
+    if user_id is not None:
+        try:
+            filters["user_id"] = int(user_id)
+        except ValueError:
+            abort(status.HTTP_400_BAD_REQUEST, f"Invalid user_id '{user_id}'")
+    for name in ("created_from", "created_to"):
+        value = request.args.get(name)
+        if value is None:
+            continue
+        try:
+            filters[name] = datetime.strptime(value, DATETIME_FORMAT).date()
+        except ValueError:
+            abort(status.HTTP_400_BAD_REQUEST, f"Invalid {name} '{value}'")
+    return filters
+
+def get_page_limit():
+    """ Returns the page size requested by the client """
+    limit = request.args.get("limit", app.config["PAGE_SIZE_DEFAULT"])
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= app.config["PAGE_SIZE_MAX"]:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"limit must be between 1 and {app.config['PAGE_SIZE_MAX']}",
+        )
+    return limit
+
+def encode_cursor(last_id):
+    """ Encodes the id of the last record on a page as an opaque cursor """
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode()
+
+def decode_cursor(cursor):
+    """ Decodes a cursor back into the id of the last record seen """
+    if not cursor:
+        return None
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (binascii.Error, UnicodeError, ValueError):
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid cursor '{cursor}'")
+
+def next_page_headers(cursor):
+    """ Builds the headers that point the client at the next page """
+    args = request.args.to_dict()
+    args["cursor"] = cursor
+    next_url = url_for(request.endpoint, _external=True, **request.view_args, **args)
+    return {"X-Next-Cursor": cursor, "Link": f'<{next_url}>; rel="next"'}
@@ -0,0 +1,71 @@
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Module: shards
+
+Placement of Wishlists and their Items on the shards of the database
+
+A Wishlist lives on the shard of its user, user_id modulo the number of
+shards, and its Items live with it. Every shard hands out ids that are
+congruent to its number plus one modulo the number of shards, so ids are
+unique across shards and an id alone tells which shard holds the record.
+The number of shards can therefore not change without moving the data.
+"""
+from contextvars import ContextVar
+from contextlib import contextmanager
+
+# The shard db.session works on in the current thread or task
+current_shard = ContextVar("current_shard", default=0)
+
+
+class ShardMap():
+    """ Maps users and ids to the number of the shard that holds them """
+
+    def __init__(self, count=1):
+        self.count = count
+
+    def configure(self, count):
+        """ Sets the number of shards """
+        self.count = count
+
+    def __iter__(self):
+        return iter(range(self.count))
+
+    @property
+    def sharded(self):
+        """ True when there is more than one shard """
+        return self.count > 1
+
+    def for_user(self, user_id):
+        """ Returns the shard of the Wishlists of a user """
+        return (user_id or 0) % self.count
+
+    def for_id(self, by_id):
+        """ Returns the shard of a Wishlist or Item id """
+        return (by_id - 1) % self.count if by_id else 0
+
+    def next_id(self, shard, last_id):
+        """ Returns the first id of a shard greater than last_id """
+        last_id = last_id or 0
+        return last_id + 1 + (shard - last_id) % self.count
+
+
+@contextmanager
+def use_shard(shard):
+    """ Makes db.session work on a shard inside the with block """
+    token = current_shard.set(shard)
+    try:
+        yield shard
+    finally:
+        current_shard.reset(token)
@@ -0,0 +1,61 @@
+"""
+Query budget assertions for the test suite
+
+Counts the SQL statements sent to the database so that N+1 query
+regressions fail the tests like functional ones do
+"""
+from contextlib import contextmanager
+from sqlalchemy import event
+from service.models import db
+
+
+class QueryCounter():
+    """ Records every SQL statement executed on some engines while active """
+
+    def __init__(self, *engines):
+        self.engines = engines
+        self.statements = []
+
+    def __enter__(self):
+        for engine in self.engines:
+            event.listen(engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        for engine in self.engines:
+            event.remove(engine, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument,too-many-arguments
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        """ The number of statements executed so far """
+        return len(self.statements)
+
+
+class QueryBudgetMixin():
+    """ Adds SQL statement budget assertions to a TestCase """
+
+    def query_engines(self):
+        """ Returns the engines whose statements count against a budget """
+        return [db.engine]
+
+    @contextmanager
+    def assertMaxQueries(self, budget):  # pylint: disable=invalid-name
+        """
+        Fails if the block executes more than budget SQL statements
+
+        Read streamed response bodies inside the block, they run
+        their queries while the body is being consumed.
+        """
+        with QueryCounter(*self.query_engines()) as counter:
+            yield counter
+        if counter.count > budget:
+            statements = "\n".join(
+                f"  {number}. {statement}"
+                for number, statement in enumerate(counter.statements, start=1)
+            )
+            self.fail(
+                f"{counter.count} SQL statements executed, the budget is {budget}:\n{statements}"
+            )
@@ -0,0 +1,72 @@
+"""
+Test cases for the LRU cache
+
+"""
+import unittest
+from service.cache import LRUCache
+
+
+class FakeClock():
+    """ A clock that only moves when told to """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+######################################################################
+#  L R U   C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUCache(unittest.TestCase):
+    """ Test Cases for LRUCache """
+
+    def setUp(self):
+        """ This runs before each test """
+        self.clock = FakeClock()
+        self.cache = LRUCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_get_and_set(self):
+        """ Store and read back a value """
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", {"id": 1})
+        self.assertEqual(self.cache.get("a"), {"id": 1})
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        """ Evict the least recently used value when full """
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("c"), 3)
+
+    def test_entries_expire(self):
+        """ Expire values after the time to live """
+        self.cache.set("a", 1)
+        self.clock.now = 9.9
+        self.assertEqual(self.cache.get("a"), 1)
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_evict(self):
+        """ Evict values by key and by predicate """
+        self.cache.set(("Item", 1), {"wishlist_id": 5})
+        self.cache.set(("Item", 2), {"wishlist_id": 6})
+        self.cache.evict_where(lambda key, value: value["wishlist_id"] == 5)
+        self.assertIsNone(self.cache.get(("Item", 1)))
+        self.cache.evict(("Item", 2), ("Item", 3))
+        self.assertIsNone(self.cache.get(("Item", 2)))
+
+    def test_disabled(self):
+        """ Store nothing when the size is zero """
+        self.cache.configure(0, 10)
+        self.cache.set("a", 1)
+        self.assertIsNone(self.cache.get("a"))
@@ -0,0 +1,59 @@
+"""
+Test cases for the HTTP load benchmark reporting
+
+"""
+import unittest
+from benchmarks.http_load import percentile, summarize, compare
+
+
+######################################################################
+#  H T T P   L O A D   T E S T   C A S E S
+######################################################################
+class TestHttpLoad(unittest.TestCase):
+    """ Test Cases for the benchmark statistics """
+
+    def test_percentile(self):
+        """ Nearest-rank percentiles of sorted samples """
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 95), 95)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summarize(self):
+        """ Summarize the latencies of a route """
+        result = summarize([0.003, 0.001, 0.002, 0.004], errors=1, elapsed=2.0)
+        self.assertEqual(result["requests"], 5)
+        self.assertEqual(result["errors"], 1)
+        self.assertEqual(result["rps"], 2.0)
+        self.assertEqual(result["p50_ms"], 2.0)
+        self.assertEqual(result["p99_ms"], 4.0)
+        self.assertEqual(result["max_ms"], 4.0)
+        self.assertEqual(result["mean_ms"], 2.5)
+
+    def test_summarize_all_errors(self):
+        """ Summarize a route where every request failed """
+        result = summarize([], errors=3, elapsed=1.0)
+        self.assertEqual(result["requests"], 3)
+        self.assertIsNone(result["p95_ms"])
+        self.assertIsNone(result["mean_ms"])
+
+    def test_compare(self):
+        """ Flag latency and throughput regressions beyond the threshold """
+        baseline = {
+            "get": {"p50_ms": 10.0, "p95_ms": 20.0, "p99_ms": 30.0, "rps": 100.0},
+            "gone": {"p50_ms": 1.0, "p95_ms": 1.0, "p99_ms": 1.0, "rps": 1.0},
+        }
+        results = {
+            "get": {"p50_ms": 10.5, "p95_ms": 25.0, "p99_ms": 30.0, "rps": 80.0},
+            "new": {"p50_ms": 1.0, "p95_ms": 1.0, "p99_ms": 1.0, "rps": 1.0},
+        }
+        regressions = compare(results, baseline, threshold=0.10)
+        self.assertEqual(regressions, ["get: p95_ms 20.0 -> 25.0", "get: rps 100.0 -> 80.0"])
+
+    def test_compare_ignores_noise(self):
+        """ Small absolute latency changes are not regressions """
+        baseline = {"get": {"p50_ms": 0.5, "p95_ms": 0.5, "p99_ms": 0.5, "rps": 100.0}}
+        results = {"get": {"p50_ms": 0.9, "p95_ms": 0.9, "p99_ms": 0.9, "rps": 100.0}}
+        self.assertEqual(compare(results, baseline, threshold=0.10), [])
@@ -0,0 +1,107 @@
+"""
+Test cases for the JSON encoder
+
+"""
+import json
+import uuid
+import decimal
+import unittest
+from datetime import date, datetime
+from unittest.mock import patch
+from service import app, json_encoder
+from service.json_encoder import JSONEncoder
+
+
+def standard(data, **kwargs):
+    """ Encodes like jsonify() does with the standard library """
+    kwargs.setdefault("separators", (",", ":"))
+    return json.dumps(data, cls=StandardEncoder, sort_keys=True, **kwargs)
+
+
+class StandardEncoder(JSONEncoder):
+    """ The same encoder without orjson """
+
+    def encode(self, o):
+        return json.JSONEncoder.encode(self, o)
+
+
+######################################################################
+#  J S O N   E N C O D E R   T E S T   C A S E S
+######################################################################
+class TestJSONEncoder(unittest.TestCase):
+    """ Test Cases for JSONEncoder """
+
+    def assertSameBytes(self, data, **kwargs):  # pylint: disable=invalid-name
+        """ The encoder must produce what the standard library does """
+        kwargs.setdefault("separators", (",", ":"))
+        self.assertEqual(
+            json.dumps(data, cls=JSONEncoder, sort_keys=True, **kwargs), standard(data, **kwargs)
+        )
+
+    def test_wishlist_payload(self):
+        """ Encode a list of wishlists like the standard library """
+        wishlists = [
+            {
+                "id": number, "name": f"list {number}", "type": "public", "user_id": 7,
+                "created_date": "2022-04-01", "version": 1,
+                "items": [
+                    {"id": item, "wishlist_id": number, "name": "book \"one\"\n",
+                     "category": "books", "price": item * 1.25, "in_stock": True,
+                     "purchased": False, "version": None}
+                    for item in range(5)
+                ],
+            }
+            for number in range(20)
+        ]
+        self.assertSameBytes(wishlists)
+
+    def test_floats(self):
+        """ Floats orjson writes differently fall back to the standard library """
+        for value in (0.1, 12.5, 1e15, 1e16, 1e-4, 1e-5, 1.2345678901234568e+17, -0.0):
+            self.assertSameBytes({"price": value})
+
+    def test_strings(self):
+        """ Non-ASCII and DEL are escaped like the standard library """
+        for value in ("café", "\x7f", " ", "\x00\x1f", "emoji \U0001F600"):
+            self.assertSameBytes({"name": value})
+            self.assertSameBytes({"name": value}, ensure_ascii=False)
+
+    def test_other_types(self):
+        """ Encode dates, decimals, UUIDs and big integers """
+        data = {
+            "date": date(2022, 4, 1),
+            "datetime": datetime(2022, 4, 1, 12, 30, 15, 1),
+            "decimal": decimal.Decimal("1.10"),
+            "uuid": uuid.UUID(int=1),
+            "big": 2 ** 70,
+        }
+        self.assertSameBytes(data)
+        self.assertIn('"date":"2022-04-01"', json.dumps(data, cls=JSONEncoder, separators=(",", ":"), sort_keys=True))
+
+    def test_indent(self):
+        """ Indented output comes from the standard library """
+        data = {"b": [1, 2], "a": "x"}
+        self.assertSameBytes(data, indent=2, separators=(", ", ": "))
+        self.assertSameBytes(data, separators=None)
+
+    def test_without_orjson(self):
+        """ Fall back to the standard library when orjson is not installed """
+        with patch.object(json_encoder, "orjson", None):
+            self.assertSameBytes({"date": date(2022, 4, 1), "price": 1e16})
+
+    def test_app_encoder(self):
+        """ The app encodes its responses with this encoder """
+        self.assertIs(app.json_encoder, JSONEncoder)
+        with app.test_request_context():
+            from flask import jsonify  # pylint: disable=import-outside-toplevel
+            response = jsonify({"b": 1, "a": date(2022, 4, 1)})
+        self.assertEqual(response.get_data(), b'{"a":"2022-04-01","b":1}\n')
+
+    def test_streamed_records(self):
+        """ Records of streamed bodies are compact so orjson encodes them """
+        data = {"b": [1, 2], "a": date(2022, 4, 1)}
+        with app.app_context(), patch.object(
+            json_encoder.orjson, "dumps", wraps=json_encoder.orjson.dumps
+        ) as dumps:
+            self.assertEqual(json_encoder.dumps(data), '{"a":"2022-04-01","b":[1,2]}')
+        dumps.assert_called_once()
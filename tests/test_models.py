@@ -5,6 +5,8 @@ Test cases for Wishlist Model
 import logging
 import unittest
 import os
+from datetime import date
+from sqlalchemy.orm.exc import StaleDataError
 from service import app, status
 from service.models import Wishlist, Item, DataValidationError, db
 from tests.factories import WishlistFactory, ItemFactory
@@ -148,6 +150,23 @@ class TestWishlist(unittest.TestCase):
         wishlist = Wishlist.find(wishlist.id)
         self.assertEqual(wishlist.name, "pets")
 
+    def test_update_a_wishlist_concurrently(self):
+        """ Reject an update of a wishlist changed since it was read """
+        wishlist = self._create_wishlist()
+        wishlist.create()
+        wishlist = Wishlist.find(wishlist.id)
+        self.assertEqual(wishlist.version, 1)
+
+        # another transaction commits a change after we read it
+        with db.engine.begin() as connection:
+            connection.execute(
+                Wishlist.__table__.update().values(name="theirs", version=2)
+            )
+        wishlist.name = "ours"
+        self.assertRaises(StaleDataError, wishlist.update)
+        db.session.rollback()
+        self.assertEqual(Wishlist.find(wishlist.id).name, "theirs")
+
     def test_delete_an_wishlist(self):
         """ Delete a wishlist from the database """
         wishlists = Wishlist.all()
@@ -173,6 +192,78 @@ class TestWishlist(unittest.TestCase):
         self.assertEqual(same_wishlist.id, wishlist.id)
         self.assertEqual(same_wishlist.name, wishlist.name)
     
+    def test_find_by_filters(self):
+        """ Find wishlists by several filters """
+        for user_id, name in [(1, "gifts"), (1, "gift ideas"), (2, "gifts"), (1, "home")]:
+            wishlist = self._create_wishlist()
+            wishlist.user_id = user_id
+            wishlist.name = name
+            wishlist.create()
+        self.assertEqual(Wishlist.find_by_filters(user_id=1).count(), 3)
+        self.assertEqual(Wishlist.find_by_filters(user_id=1, name_prefix="gift").count(), 2)
+        self.assertEqual(Wishlist.find_by_filters(name="gifts").count(), 2)
+        self.assertEqual(Wishlist.find_by_filters(name_prefix="gift_").count(), 0)
+
+    def test_filters_use_indexes(self):
+        """ Filter wishlists through their indexes """
+        if db.engine.dialect.name != "postgresql":
+            self.skipTest("EXPLAIN output is PostgreSQL specific")
+        connection = db.session.connection()
+        # the tables are tiny, so rule out the sequential scan they would get
+        connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+
+        def explain(query):
+            statement = query.statement.compile(connection)
+            rows = connection.exec_driver_sql(f"EXPLAIN {statement}", statement.params)
+            return "\n".join(row[0] for row in rows)
+
+        self.assertIn("ix_wishlist_user_id_id", explain(
+            Wishlist.find_by_filters(user_id=1).filter(Wishlist.id > 5).order_by(Wishlist.id)
+        ))
+        self.assertIn("ix_wishlist_user_id_created_date", explain(
+            Wishlist.find_by_filters(user_id=1, created_from=date(2022, 4, 1))
+        ))
+        self.assertIn("ix_wishlist_created_date", explain(
+            Wishlist.find_by_filters(created_from=date(2022, 4, 1))
+        ))
+        self.assertIn("ix_wishlist_name", explain(Wishlist.find_by_filters(name_prefix="gift")))
+        self.assertIn("ix_item_wishlist_id", explain(Item.find_by_wishlist(1)))
+
+    def test_keyset_page(self):
+        """ Page through wishlists by id """
+        for _ in range(5):
+            self._create_wishlist().create()
+        page, has_more = Wishlist.keyset(Wishlist.query, 3)
+        self.assertEqual([w.id for w in page], [1, 2, 3])
+        self.assertTrue(has_more)
+        page, has_more = Wishlist.keyset(Wishlist.query, 3, after_id=page[-1].id)
+        self.assertEqual([w.id for w in page], [4, 5])
+        self.assertFalse(has_more)
+
+    def test_with_items(self):
+        """ Load the items of many wishlists up front """
+        for _ in range(3):
+            wishlist = self._create_wishlist(items=[self._create_item()])
+            wishlist.create()
+        db.session.expire_all()
+        wishlists = Wishlist.with_items().all()
+        self.assertEqual(len(wishlists), 3)
+        for wishlist in wishlists:
+            self.assertIn("items", wishlist.__dict__)
+            self.assertEqual(len(wishlist.items), 1)
+
+        db.session.expire_all()
+        wishlist = Wishlist.find_with_items(wishlists[0].id)
+        self.assertIn("items", wishlist.__dict__)
+        self.assertIsNone(Wishlist.find_with_items(0))
+
+    def test_serialize_an_wishlist_summary(self):
+        """ Serialize an wishlist without its items """
+        wishlist = self._create_wishlist(items=[self._create_item()])
+        serial_wishlist = wishlist.serialize(include_items=False)
+        self.assertNotIn("items", serial_wishlist)
+        self.assertEqual(serial_wishlist["name"], wishlist.name)
+
     def test_serialize_an_wishlist(self):
         """ Serialize an wishlist """
         item = self._create_item()
@@ -193,6 +284,21 @@ class TestWishlist(unittest.TestCase):
         self.assertEqual(items[0]['in_stock'], item.in_stock)
         self.assertEqual(items[0]['purchased'], item.purchased)
 
+    def test_serialize_wishlist_fields(self):
+        """ Serialize only some fields of an wishlist """
+        item = self._create_item()
+        wishlist = self._create_wishlist(items=[item])
+        wishlist.create()
+        self.assertIn("items", Wishlist.field_names())
+        self.assertNotIn("items", Item.field_names())
+        found = Wishlist.find_fields(wishlist.id, ["created_date", "id"])
+        self.assertEqual(
+            found.serialize_fields(["created_date", "id"]),
+            {"id": wishlist.id, "created_date": wishlist.serialize()["created_date"]},
+        )
+        found = Wishlist.find_fields(wishlist.id, ["id", "items"])
+        self.assertEqual(found.serialize_fields(["id", "items"])["items"][0]["name"], item.name)
+
     def test_deserialize_an_wishlist(self):
         """ Deserialize an wishlist """
         item = self._create_item()
@@ -250,6 +356,25 @@ class TestWishlist(unittest.TestCase):
         self.assertEqual(len(wishlist.items), 2)
         self.assertEqual(wishlist.items[1].name, item2.name)
 
+    def test_purchase_item(self):
+        """ Purchase an item only while it is in stock and unpurchased """
+        in_stock = self._create_item()
+        in_stock.in_stock = True
+        in_stock.purchased = False
+        sold_out = self._create_item()
+        sold_out.in_stock = False
+        wishlist = self._create_wishlist(items=[in_stock, sold_out])
+        wishlist.create()
+
+        item = Item.purchase(in_stock.id)
+        self.assertEqual(item.id, in_stock.id)
+        self.assertTrue(item.purchased)
+        self.assertIsNone(Item.purchase(in_stock.id))
+        self.assertIsNone(Item.purchase(sold_out.id))
+        self.assertIsNone(Item.purchase(0))
+        self.assertTrue(Item.find(in_stock.id).purchased)
+        self.assertEqual(Wishlist.find(wishlist.id).version, 2)
+
     def test_update_wishlist_item(self):
         """ Update a wishlist item """
         wishlists = Wishlist.all()
@@ -298,3 +423,51 @@ class TestWishlist(unittest.TestCase):
         # Fetch it back again
         wishlist = Wishlist.find(wishlist.id)
         self.assertEqual(len(wishlist.items), 0)
+
+    def assert_counters(self, wishlist_id):
+        """ Checks the counters of a Wishlist against its Items in the database """
+        db.session.expire_all()
+        wishlist = Wishlist.find(wishlist_id)
+        items = Item.find_by_wishlist(wishlist_id).all()
+        self.assertEqual(
+            (wishlist.item_count, wishlist.total_price, wishlist.purchased_count),
+            (len(items), sum(item.price for item in items), sum(item.purchased for item in items)),
+        )
+        return wishlist
+
+    def test_item_counters(self):
+        """ The item count, total price and purchased count follow every change to the Items """
+        first = self._create_item()
+        first.price, first.purchased, first.in_stock = 10, False, True
+        second = self._create_item()
+        second.price, second.purchased = 25, True
+        wishlist = self._create_wishlist(items=[first, second])
+        wishlist.create()
+        other = self._create_wishlist(items=[])
+        other.create()
+        summary = self.assert_counters(wishlist.id).serialize(include_items=False)
+        self.assertEqual(
+            (summary["item_count"], summary["total_price"], summary["purchased_count"]), (2, 35, 1)
+        )
+
+        third = self._create_item()
+        third.wishlist_id, third.price = wishlist.id, 5
+        third.create()
+        self.assert_counters(wishlist.id)
+        third.price = 50
+        third.update()
+        self.assertEqual(self.assert_counters(wishlist.id).total_price, 85)
+        third.wishlist_id = other.id
+        third.update()
+        self.assert_counters(wishlist.id)
+        self.assertEqual(self.assert_counters(other.id).item_count, 1)
+        Item.find(second.id).delete()
+        self.assertEqual(self.assert_counters(wishlist.id).purchased_count, 0)
+
+        if DATABASE_URI.startswith("postgresql"):  # these statements need RETURNING
+            Item.purchase(first.id)
+            self.assertEqual(self.assert_counters(wishlist.id).purchased_count, 1)
+            extra = self._create_item()
+            extra.wishlist_id = other.id
+            Item.bulk_create([extra])
+            self.assertEqual(self.assert_counters(other.id).item_count, 2)
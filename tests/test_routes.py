@@ -6,12 +6,20 @@ Test cases can be run with the following:
   coverage report -m
 """
 import os
+import io
+import csv
+import gzip
+import json
+import time
 import logging
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
+from prometheus_client import REGISTRY
 from tests.factories import WishlistFactory, ItemFactory
+from tests.query_budget import QueryBudgetMixin
 from service import status  # HTTP Status Codes
-from service.models import db
+from service import routes
+from service.models import db, cache, Item
 from service.routes import app, init_db
 
 DATABASE_URI = os.getenv(
@@ -24,7 +32,7 @@ CONTENT_TYPE_JSON = "application/json"
 ######################################################################
 #  T E S T   C A S E S
 ######################################################################
-class TestWishlistService(TestCase):
+class TestWishlistService(QueryBudgetMixin, TestCase):
     """ Wishlist Service Tests """
 
     @classmethod
@@ -33,6 +41,8 @@ class TestWishlistService(TestCase):
         app.config['TESTING'] = True
         app.config['DEBUG'] = False
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
+        # the cache is off by default, every route runs with it to test its invalidation
+        app.config["CACHE_SIZE"] = 1024
         app.logger.setLevel(logging.CRITICAL)
         init_db()
 
@@ -72,6 +82,17 @@ class TestWishlistService(TestCase):
             wishlists.append(wishlist)
         return wishlists
 
+    def _create_wishlists_with_items(self, count, items_per_wishlist):
+        """ Factory method to create wishlists that each hold some items """
+        wishlists = self._create_wishlists(count)
+        for wishlist in wishlists:
+            resp = self.app.post(
+                f"{BASE_URL}/{wishlist.id}/items/bulk",
+                json=[item.serialize() for item in ItemFactory.create_batch(items_per_wishlist)],
+            )
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        return wishlists
+
 ######################################################################
 #  W I S H L I S T   T E S T   C A S E S
 ######################################################################
@@ -81,6 +102,49 @@ class TestWishlistService(TestCase):
         resp = self.app.get("/")
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
 
+    def test_service_stats(self):
+        """ Get the pool, cache and replica statistics """
+        resp = self.app.get("/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertIn("checkedout", data["pool"])
+        self.assertIn("hits", data["cache"])
+        self.assertEqual(data["replicas"]["replicas"], [])
+
+    def test_metrics(self):
+        """ Get the Prometheus metrics """
+        wishlist = self._create_wishlists(1)[0]
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        text = resp.get_data(as_text=True)
+        self.assertIn(
+            'wishlist_http_requests_total{endpoint="get_wishlists",method="GET",status="200"}',
+            text
+        )
+        self.assertIn('wishlist_http_request_duration_seconds_bucket{endpoint="create_wishlists"', text)
+        self.assertIn('wishlist_db_queries_per_request_count{endpoint="get_wishlists"}', text)
+        self.assertIn('wishlist_cache_events{result="hit"}', text)
+        self.assertIn('wishlist_db_pool_connections{state="checkedout"}', text)
+
+    def test_metrics_time_streamed_bodies(self):
+        """ The latency of a streamed listing covers sending its body """
+        self._create_wishlists(2)
+        listing = routes.wishlist_listing
+
+        def slow_listing(*args):
+            query, serialize = listing(*args)
+            return query, lambda wishlist: time.sleep(0.05) or serialize(wishlist)
+
+        labels = {"endpoint": "list_wishlists", "method": "GET", "status": "200"}
+        before = REGISTRY.get_sample_value("wishlist_http_request_duration_seconds_sum", labels) or 0
+        with patch.object(routes, "wishlist_listing", side_effect=slow_listing):
+            resp = self.app.get(BASE_URL, query_string="stream=true", buffered=True)
+        self.assertEqual(len(resp.get_json()), 2)
+        after = REGISTRY.get_sample_value("wishlist_http_request_duration_seconds_sum", labels)
+        self.assertGreaterEqual(after - before, 0.1)
+
     def test_get_wishlist_list(self):
         """ Get a list of Wishlists """
         self._create_wishlists(5)
@@ -100,6 +164,72 @@ class TestWishlistService(TestCase):
         data = resp.get_json()
         self.assertEqual(data[0]["name"], wishlists[1].name)
 
+    def test_get_wishlist_filtered(self):
+        """ Get Wishlists matching several filters """
+        wishlists = self._create_wishlists(6)
+        user_id = wishlists[0].user_id
+        wishlist_type = wishlists[0].type
+        resp = self.app.get(
+            BASE_URL,
+            query_string={"user_id": user_id, "type": wishlist_type, "created_from": "2022-04-01"}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(w["id"] for w in resp.get_json()),
+            [w.id for w in wishlists if w.user_id == user_id and w.type == wishlist_type]
+        )
+
+        prefix = wishlists[0].name[:3]
+        resp = self.app.get(BASE_URL, query_string={"name_prefix": prefix})
+        self.assertEqual(
+            sorted(w["id"] for w in resp.get_json()),
+            [w.id for w in wishlists if w.name.startswith(prefix)]
+        )
+        resp = self.app.get(BASE_URL, query_string={"name_prefix": "%"})
+        self.assertEqual(resp.get_json(), [])
+        resp = self.app.get(BASE_URL, query_string={"created_to": "2022-03-31"})
+        self.assertEqual(resp.get_json(), [])
+
+    def test_get_wishlist_pages(self):
+        """ Page through Wishlists with a cursor """
+        wishlists = self._create_wishlists(5)
+        resp = self.app.get(BASE_URL, query_string="limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([w["id"] for w in data], [w.id for w in wishlists[:2]])
+        self.assertIn('rel="next"', resp.headers["Link"])
+
+        # follow the cursors until the last page
+        seen = [w["id"] for w in data]
+        while "X-Next-Cursor" in resp.headers:
+            resp = self.app.get(
+                BASE_URL, query_string={"limit": 2, "cursor": resp.headers["X-Next-Cursor"]}
+            )
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            seen.extend(w["id"] for w in resp.get_json())
+        self.assertEqual(seen, [w.id for w in wishlists])
+        self.assertNotIn("Link", resp.headers)
+
+    def test_get_wishlist_page_by_name(self):
+        """ Page through Wishlists filtered by name """
+        wishlists = self._create_wishlists(4)
+        name = wishlists[0].name
+        expected = [w.id for w in wishlists if w.name == name]
+        resp = self.app.get(BASE_URL, query_string={"name": name, "limit": 1})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([w["id"] for w in data], expected[:1])
+        self.assertEqual("X-Next-Cursor" in resp.headers, len(expected) > 1)
+
+    def test_get_wishlist_page_bad_args(self):
+        """ Page through Wishlists with a bad limit or cursor """
+        resp = self.app.get(BASE_URL, query_string="limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(BASE_URL, query_string="limit=abc")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(BASE_URL, query_string="cursor=!!!")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_get_wishlist(self):
         """ Get a single Wishlist """
         # get the id of an wishlist
@@ -112,6 +242,178 @@ class TestWishlistService(TestCase):
         data = resp.get_json()
         self.assertEqual(data["name"], wishlist.name)
 
+    def test_get_wishlist_summary(self):
+        """ Get Wishlists without their items """
+        wishlist = self._create_wishlists(1)[0]
+        resp = self.app.post(
+            f"{BASE_URL}/{wishlist.id}/items",
+            json=ItemFactory().serialize(),
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        resp = self.app.get(BASE_URL, query_string="expand=items")
+        self.assertEqual(len(resp.get_json()[0]["items"]), 1)
+        resp = self.app.get(BASE_URL, query_string="expand=none")
+        self.assertNotIn("items", resp.get_json()[0])
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}", query_string="expand=")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotIn("items", resp.get_json())
+
+    def test_get_wishlist_fields(self):
+        """ Get only some fields of Wishlists """
+        wishlists = self._create_wishlists_with_items(2, 3)
+        with self.assertMaxQueries(1) as counter:
+            resp = self.app.get(BASE_URL, query_string="fields=name")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [{"id": w.id, "name": w.name} for w in wishlists])
+        self.assertNotIn("wishlist.type", counter.statements[0])
+
+        resp = self.app.get(BASE_URL, query_string="fields=created_date,items&limit=1")
+        data = resp.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(set(data[0]), {"id", "created_date", "items"})
+        self.assertEqual(data[0]["created_date"], str(wishlists[0].created_date))
+        self.assertEqual(len(data[0]["items"]), 3)
+
+        resp = self.app.get(BASE_URL, query_string="fields=name&stream=1")
+        self.assertEqual(resp.get_json()[1], {"id": wishlists[1].id, "name": wishlists[1].name})
+
+        resp = self.app.get(f"{BASE_URL}/{wishlists[0].id}", query_string="fields=user_id,version")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            resp.get_json(), {"id": wishlists[0].id, "user_id": wishlists[0].user_id, "version": 2}
+        )
+        etag = resp.headers["ETag"]
+        resp = self.app.get(f"{BASE_URL}/{wishlists[0].id}")
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        resp = self.app.get(
+            f"{BASE_URL}/{wishlists[0].id}",
+            query_string="fields=version,user_id",
+            headers={"If-None-Match": etag},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_get_wishlist_fields_bad_request(self):
+        """ Reject unknown fields and unknown Wishlists """
+        resp = self.app.get(BASE_URL, query_string="fields=name,secret")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("secret", resp.get_json()["message"])
+        resp = self.app.get(f"{BASE_URL}/0", query_string="fields=name")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.get(f"{BASE_URL}/0/items", query_string="fields=name")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_stream_wishlist_list(self):
+        """ Stream a list of Wishlists """
+        wishlists = self._create_wishlists(3)
+        resp = self.app.get(BASE_URL, query_string="stream=true")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/json")
+        data = resp.get_json()
+        self.assertEqual([w["id"] for w in data], [w.id for w in wishlists])
+        self.assertEqual(data[0]["items"], [])
+
+        resp = self.app.get(BASE_URL, headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines], [w.id for w in wishlists])
+
+    def test_stream_empty_wishlist_list(self):
+        """ Stream an empty list of Wishlists """
+        resp = self.app.get(BASE_URL, query_string="stream=true")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [])
+
+    def test_get_wishlist_cached(self):
+        """ Get a Wishlist from the cache until it changes """
+        wishlist = self._create_wishlists(1)[0]
+        hits = cache.stats()["hits"]
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(cache.stats()["hits"], hits + 1)
+
+        # adding an item invalidates the cached wishlist
+        resp = self.app.post(
+            f"{BASE_URL}/{wishlist.id}/items",
+            json=ItemFactory().serialize(),
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        item_id = resp.get_json()["id"]
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}/items")
+        self.assertEqual(len(resp.get_json()), 1)
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}/items/{item_id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+        # deleting the wishlist invalidates its cached items
+        resp = self.app.delete(f"{BASE_URL}/{wishlist.id}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}/items/{item_id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_wishlist_not_modified(self):
+        """ Get a Wishlist with If-None-Match """
+        wishlist = self._create_wishlists(1)[0]
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp.headers["ETag"]
+        self.assertEqual(resp.get_json()["version"], 1)
+
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], etag)
+        self.assertEqual(resp.data, b"")
+
+        # the summary is a different representation
+        resp = self.app.get(
+            f"{BASE_URL}/{wishlist.id}", query_string="expand=none",
+            headers={"If-None-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_item_changes_bump_wishlist_version(self):
+        """ Change the ETag of a Wishlist when its Items change """
+        wishlist = self._create_wishlists(1)[0]
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}/items")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp.headers["ETag"]
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}/items", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        resp = self.app.post(
+            f"{BASE_URL}/{wishlist.id}/items",
+            json=ItemFactory().serialize(),
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        item = resp.get_json()
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}/items", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp.headers["ETag"]
+
+        item["name"] = "renamed"
+        resp = self.app.put(
+            f"{BASE_URL}/{wishlist.id}/items/{item['id']}",
+            json=item,
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.post(
+            f"{BASE_URL}/{wishlist.id}/items/bulk",
+            json=[ItemFactory().serialize()],
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}")
+        self.assertEqual(resp.get_json()["version"], 4)
+
     def test_get_wishlist_not_found(self):
         """Get a Wishlist that is not found"""
         resp = self.app.get(f"{BASE_URL}/0")
@@ -149,6 +451,87 @@ class TestWishlistService(TestCase):
         self.assertEqual(new_wishlist["user_id"], wishlist.user_id, "user_id does not match")
         self.assertEqual(new_wishlist["created_date"], str(wishlist.created_date), "Created Date does not match")
     
+    def test_import_wishlists(self):
+        """ Import Wishlists from NDJSON """
+        lines = []
+        for wishlist in WishlistFactory.create_batch(3):
+            data = wishlist.serialize()
+            data["created_date"] = "2022-04-01"
+            data["items"] = [item.serialize() for item in ItemFactory.create_batch(2)]
+            lines.append(json.dumps(data))
+        lines.insert(1, "{not json")
+        lines.insert(2, json.dumps({"name": "missing fields"}))
+        resp = self.app.post(
+            f"{BASE_URL}/import",
+            data="\n".join(lines) + "\n",
+            content_type="application/x-ndjson"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        reports = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual([r["line"] for r in reports if "error" in r], [2, 3])
+        self.assertEqual(reports[-1]["imported"], 3)
+
+        resp = self.app.get(BASE_URL)
+        data = resp.get_json()
+        self.assertEqual(len(data), 3)
+        for wishlist in data:
+            self.assertEqual(len(wishlist["items"]), 2)
+
+    def test_import_wishlists_bad_media_type(self):
+        """ Import Wishlists with the wrong media type """
+        resp = self.app.post(f"{BASE_URL}/import", json=[], content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_export_wishlists(self):
+        """ Export Wishlists as NDJSON and CSV """
+        wishlists = self._create_wishlists(3)
+        resp = self.app.post(
+            f"{BASE_URL}/{wishlists[0].id}/items/bulk",
+            json=[item.serialize() for item in ItemFactory.create_batch(2)],
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        resp = self.app.get(f"{BASE_URL}/export")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        data = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual([w["id"] for w in data], [w.id for w in wishlists])
+        self.assertEqual(len(data[0]["items"]), 2)
+
+        resp = self.app.get(f"{BASE_URL}/export", query_string="format=csv&gzip=true")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        rows = list(csv.reader(io.StringIO(gzip.decompress(resp.data).decode())))
+        self.assertEqual(rows[0][0], "wishlist_id")
+        self.assertEqual(len(rows), 1 + 2 + 2)
+
+    def test_export_wishlists_filtered(self):
+        """ Export the Wishlists of one user """
+        wishlists = self._create_wishlists(4)
+        user_id = wishlists[0].user_id
+        resp = self.app.get(
+            f"{BASE_URL}/export",
+            query_string={"user_id": user_id, "created_from": "2022-04-01", "created_to": "2022-04-01"}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual(
+            [w["id"] for w in data],
+            [w.id for w in wishlists if w.user_id == user_id]
+        )
+        resp = self.app.get(f"{BASE_URL}/export", query_string="created_from=2022-04-02")
+        self.assertEqual(resp.get_data(as_text=True), "")
+
+    def test_export_wishlists_bad_args(self):
+        """ Export Wishlists with bad arguments """
+        resp = self.app.get(f"{BASE_URL}/export", query_string="format=xml")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(f"{BASE_URL}/export", query_string="user_id=me")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(f"{BASE_URL}/export", query_string="created_to=yesterday")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_update_wishlist(self):
         """ Update (Edit) an existing Wishlist """
         # create a wishlist to update
@@ -173,6 +556,32 @@ class TestWishlistService(TestCase):
         updated_wishlist = resp.get_json()
         self.assertEqual(updated_wishlist["name"], "Pets")
     
+    def test_update_wishlist_stale_version(self):
+        """ Reject an update of a stale Wishlist """
+        wishlist = self._create_wishlists(1)[0]
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}")
+        etag = resp.headers["ETag"]
+        stale = resp.get_json()
+
+        # somebody else updates it first
+        stale["name"] = "first"
+        resp = self.app.put(
+            f"{BASE_URL}/{wishlist.id}", json=stale, headers={"If-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["version"], 2)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+        stale["name"] = "second"
+        resp = self.app.put(
+            f"{BASE_URL}/{wishlist.id}", json=stale, headers={"If-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.put(f"{BASE_URL}/{wishlist.id}", json=stale)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}")
+        self.assertEqual(resp.get_json()["name"], "first")
+
     def test_update_wishlist_not_found(self):
         """Update a Wishlist that does not exist"""
         new_wishlist = WishlistFactory()
@@ -193,6 +602,46 @@ class TestWishlistService(TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
 
+    def test_delete_wishlist_with_items(self):
+        """ Delete an Wishlist along with its Items """
+        wishlist = self._create_wishlists(1)[0]
+        resp = self.app.post(
+            f"{BASE_URL}/{wishlist.id}/items/bulk",
+            json=[item.serialize() for item in ItemFactory.create_batch(3)],
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        item_id = resp.get_json()[0]["item"]["id"]
+
+        resp = self.app.delete(f"{BASE_URL}/{wishlist.id}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}/items/{item_id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_user_wishlists(self):
+        """ Delete all Wishlists of a user """
+        wishlists = self._create_wishlists(4)
+        user_id = wishlists[0].user_id
+        resp = self.app.post(
+            f"{BASE_URL}/{wishlists[0].id}/items",
+            json=ItemFactory().serialize(),
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        resp = self.app.delete(BASE_URL, query_string=f"user_id={user_id}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.app.get(BASE_URL)
+        self.assertEqual(
+            [w["id"] for w in resp.get_json()],
+            [w.id for w in wishlists if w.user_id != user_id]
+        )
+
+    def test_delete_user_wishlists_no_user(self):
+        """ Delete all Wishlists without a user """
+        resp = self.app.delete(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     # Error handler testing code below based on the Service_Accounts code example
     def test_bad_request(self):
         """ Send wrong media type """
@@ -259,6 +708,64 @@ class TestWishlistService(TestCase):
         data = resp.get_json()
         self.assertEqual(len(data), 2)
 
+    def test_stream_item_list(self):
+        """ Stream the Items of a Wishlist """
+        wishlist = self._create_wishlists(1)[0]
+        for item in ItemFactory.create_batch(3):
+            resp = self.app.post(
+                f"{BASE_URL}/{wishlist.id}/items",
+                json=item.serialize(),
+                content_type="application/json"
+            )
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        resp = self.app.get(
+            f"{BASE_URL}/{wishlist.id}/items",
+            headers={"Accept": "application/x-ndjson"}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])["wishlist_id"], wishlist.id)
+
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}/items", query_string="stream=1")
+        self.assertEqual(len(resp.get_json()), 3)
+
+    def test_get_item_fields(self):
+        """ Get only some fields of Items """
+        wishlist = self._create_wishlists_with_items(1, 3)[0]
+        with self.assertMaxQueries(2) as counter:
+            resp = self.app.get(f"{BASE_URL}/{wishlist.id}/items", query_string="fields=name,price")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 3)
+        self.assertEqual(set(data[0]), {"id", "name", "price"})
+        self.assertNotIn("item.category", counter.statements[-1])
+        etag = resp.headers["ETag"]
+        resp = self.app.get(
+            f"{BASE_URL}/{wishlist.id}/items",
+            query_string="fields=name,price",
+            headers={"If-None-Match": etag},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        resp = self.app.get(
+            f"{BASE_URL}/{wishlist.id}/items", query_string="fields=category&stream=1"
+        )
+        self.assertEqual(set(resp.get_json()[0]), {"id", "category"})
+
+        item_id = data[0]["id"]
+        resp = self.app.get(
+            f"{BASE_URL}/{wishlist.id}/items/{item_id}", query_string="fields=purchased"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"id": item_id, "purchased": False})
+        self.assertIn("fields", resp.headers["ETag"])
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}/items/0", query_string="fields=name")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}/items", query_string="fields=items")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_add_item(self):
         """ Add an item to a wishlist """
         wishlist = self._create_wishlists(1)[0]
@@ -278,6 +785,64 @@ class TestWishlistService(TestCase):
         # self.assertEqual(data["in_stock"], item.in_stock)
         # self.assertEqual(data["purchased"], item.purchased)
 
+    def test_add_items_bulk(self):
+        """ Add many items to a wishlist at once """
+        wishlist = self._create_wishlists(1)[0]
+        items = [item.serialize() for item in ItemFactory.create_batch(3)]
+        resp = self.app.post(
+            f"{BASE_URL}/{wishlist.id}/items/bulk",
+            json=items,
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual([r["index"] for r in data], [0, 1, 2])
+        for result, item in zip(data, items):
+            self.assertEqual(result["status"], status.HTTP_201_CREATED)
+            self.assertEqual(result["item"]["name"], item["name"])
+            self.assertEqual(result["item"]["wishlist_id"], wishlist.id)
+            self.assertTrue(result["item"]["in_stock"])
+
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}/items")
+        self.assertEqual(
+            sorted(i["id"] for i in resp.get_json()),
+            [r["item"]["id"] for r in data]
+        )
+
+    def test_add_items_bulk_partial(self):
+        """ Add many items to a wishlist when some are invalid """
+        wishlist = self._create_wishlists(1)[0]
+        items = [ItemFactory().serialize(), {"name": "no category"}]
+        resp = self.app.post(
+            f"{BASE_URL}/{wishlist.id}/items/bulk",
+            json=items,
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        data = resp.get_json()
+        self.assertEqual(data[0]["status"], status.HTTP_201_CREATED)
+        self.assertEqual(data[1]["status"], status.HTTP_400_BAD_REQUEST)
+        self.assertIn("error", data[1])
+
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}/items")
+        self.assertEqual(len(resp.get_json()), 1)
+
+    def test_add_items_bulk_bad_request(self):
+        """ Add many items with a body that is not an array """
+        wishlist = self._create_wishlists(1)[0]
+        resp = self.app.post(
+            f"{BASE_URL}/{wishlist.id}/items/bulk",
+            json=ItemFactory().serialize(),
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post(
+            f"{BASE_URL}/0/items/bulk",
+            json=[],
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_get_item(self):
         """ Get an item from an wishlist """
         # create a known item
@@ -348,6 +913,34 @@ class TestWishlistService(TestCase):
         self.assertEqual(data["wishlist_id"], wishlist.id)
         self.assertEqual(data["name"], "XXXX")
 
+    def test_update_item_stale_version(self):
+        """ Reject an update of a stale Item """
+        wishlist = self._create_wishlists(1)[0]
+        resp = self.app.post(
+            f"{BASE_URL}/{wishlist.id}/items",
+            json=ItemFactory().serialize(),
+            content_type="application/json"
+        )
+        item = resp.get_json()
+        self.assertEqual(item["version"], 1)
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}/items/{item['id']}")
+        etag = resp.headers["ETag"]
+
+        item["name"] = "first"
+        resp = self.app.put(
+            f"{BASE_URL}/{wishlist.id}/items/{item['id']}", json=item, headers={"If-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["version"], 2)
+
+        item["name"] = "second"
+        resp = self.app.put(
+            f"{BASE_URL}/{wishlist.id}/items/{item['id']}", json=item, headers={"If-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.put(f"{BASE_URL}/{wishlist.id}/items/{item['id']}", json=item)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
     def test_delete_item(self):
         """ Delete an Item """
         wishlist = self._create_wishlists(1)[0]
@@ -407,6 +1000,52 @@ class TestWishlistService(TestCase):
         self.assertEqual(item_data["id"], item_id)
         self.assertEqual(item_data["purchased"], True)
 
+    def test_purchase_a_item_twice(self):
+        """Purchase an Item that was already purchased"""
+        wishlist = self._create_wishlists(1)[0]
+        resp = self.app.post(
+            f"{BASE_URL}/{wishlist.id}/items",
+            json=ItemFactory().serialize(),
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        item_id = resp.get_json()["id"]
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}")
+        version = resp.get_json()["version"]
+
+        resp = self.app.put(f"{BASE_URL}/{wishlist.id}/items/{item_id}/purchase")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertTrue(data["purchased"])
+        self.assertEqual(data["version"], 2)
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}")
+        self.assertEqual(resp.get_json()["version"], version + 1)
+        self.assertTrue(resp.get_json()["items"][0]["purchased"])
+
+        resp = self.app.put(f"{BASE_URL}/{wishlist.id}/items/{item_id}/purchase")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+    def test_purchase_item_with_null_flags(self):
+        """Purchase an Item whose in_stock and purchased columns are NULL"""
+        wishlist = self._create_wishlists(1)[0]
+        resp = self.app.post(f"{BASE_URL}/{wishlist.id}/items", json=ItemFactory().serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        item_id = resp.get_json()["id"]
+        # the defaults are set by the ORM only, rows inserted otherwise may hold NULL
+        db.session.execute(
+            Item.__table__.update().where(Item.id == item_id).values(in_stock=None, purchased=None)
+        )
+        db.session.commit()
+        cache.clear()
+
+        resp = self.app.put(f"{BASE_URL}/{wishlist.id}/items/{item_id}/purchase")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.get_json()["purchased"])
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}/summary")
+        self.assertEqual(resp.get_json()["purchased_count"], 1)
+        resp = self.app.put(f"{BASE_URL}/{wishlist.id}/items/{item_id}/purchase")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
 # Note: FIX ME PLEASE!
     # def test_purchase_not_available(self):
     #     """Purchase a Item that is not in stock"""
@@ -436,4 +1075,162 @@ class TestWishlistService(TestCase):
         wishlist = self._create_wishlists(1)[0]
         resp = self.app.put(f"{BASE_URL}/{wishlist.id}/items/{0}/purchase")
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
-    
\ No newline at end of file
+    
+
+######################################################################
+#  Q U E R Y   B U D G E T S
+######################################################################
+
+    def test_list_wishlists_query_budget(self):
+        """It should list Wishlists and their Items in a fixed number of queries"""
+        self._create_wishlists_with_items(5, 4)
+        for query_string in ("", "expand=none", "limit=2", "stream=1"):
+            cache.clear()
+            with self.assertMaxQueries(2):
+                resp = self.app.get(BASE_URL, query_string=query_string)
+                resp.get_data()
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_export_wishlists_query_budget(self):
+        """It should export Wishlists and their Items in a fixed number of queries"""
+        self._create_wishlists_with_items(5, 4)
+        with self.assertMaxQueries(2):
+            resp = self.app.get(f"{BASE_URL}/export")
+            resp.get_data()
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_get_wishlist_query_budget(self):
+        """It should read a Wishlist with one query and revalidate it from the cache"""
+        wishlist = self._create_wishlists_with_items(1, 5)[0]
+        cache.clear()
+        with self.assertMaxQueries(1):
+            resp = self.app.get(f"{BASE_URL}/{wishlist.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with self.assertMaxQueries(0):
+            resp = self.app.get(
+                f"{BASE_URL}/{wishlist.id}", headers={"If-None-Match": resp.headers["ETag"]}
+            )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_get_wishlist_counts(self):
+        """It should read the counts and total price of a Wishlist from its row alone"""
+        wishlist = self._create_wishlists_with_items(1, 4)[0]
+        items = self.app.get(f"{BASE_URL}/{wishlist.id}/items").get_json()
+        cache.clear()
+        with self.assertMaxQueries(1):
+            resp = self.app.get(f"{BASE_URL}/{wishlist.id}/summary")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["id"], wishlist.id)
+        self.assertNotIn("items", data)
+        self.assertEqual(data["item_count"], 4)
+        self.assertEqual(data["total_price"], sum(item["price"] for item in items))
+        self.assertEqual(data["purchased_count"], sum(item["purchased"] for item in items))
+        resp = self.app.get(
+            f"{BASE_URL}/{wishlist.id}/summary", headers={"If-None-Match": resp.headers["ETag"]}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        resp = self.app.delete(f"{BASE_URL}/{wishlist.id}/items/{items[0]['id']}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.app.get(f"{BASE_URL}/{wishlist.id}/summary")
+        self.assertEqual(resp.get_json()["item_count"], 3)
+        resp = self.app.get(f"{BASE_URL}/0/summary")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_counts_follow_the_wishlist_in_the_url(self):
+        """It should count Items on the Wishlist they are added to, whatever wishlist_id they carry"""
+        first, second = self._create_wishlists(2)
+        item = ItemFactory(wishlist_id=second.id, price=7).serialize()
+        resp = self.app.post(f"{BASE_URL}/{first.id}/items", json=item)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.get_json()["wishlist_id"], first.id)
+        data = self.app.get(f"{BASE_URL}/{first.id}").get_json()
+        data["items"] = [ItemFactory(wishlist_id=second.id, price=3).serialize()]
+        resp = self.app.put(f"{BASE_URL}/{first.id}", json=data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        items = self.app.get(f"{BASE_URL}/{first.id}/items").get_json()
+        self.assertEqual({item["wishlist_id"] for item in items}, {first.id})
+        counts = []
+        for wishlist in (first, second):
+            summary = self.app.get(f"{BASE_URL}/{wishlist.id}/summary").get_json()
+            counts.append((summary["item_count"], summary["total_price"]))
+        self.assertEqual(counts, [(len(items), 10), (0, 0)])
+
+    def test_wishlist_writes_query_budget(self):
+        """It should create, update and delete Wishlists in a fixed number of queries"""
+        wishlist = WishlistFactory()
+        data = wishlist.serialize()
+        data["items"] = [item.serialize() for item in ItemFactory.create_batch(5)]
+        with self.assertMaxQueries(4):
+            resp = self.app.post(BASE_URL, json=data)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        data["name"] = "renamed"
+        data["items"] = []
+        with self.assertMaxQueries(4):
+            resp = self.app.put(f"{BASE_URL}/{data['id']}", json=data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with self.assertMaxQueries(2):
+            resp = self.app.delete(f"{BASE_URL}/{data['id']}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        with self.assertMaxQueries(1):
+            resp = self.app.delete(BASE_URL, query_string=f"user_id={wishlist.user_id}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_import_wishlists_query_budget(self):
+        """It should import a batch of Wishlists in a fixed number of queries"""
+        lines = []
+        for wishlist in WishlistFactory.create_batch(10):
+            data = wishlist.serialize()
+            data["items"] = [item.serialize() for item in ItemFactory.create_batch(3)]
+            lines.append(json.dumps(data))
+        with self.assertMaxQueries(3):
+            resp = self.app.post(
+                f"{BASE_URL}/import", data="\n".join(lines), content_type="application/x-ndjson"
+            )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_item_reads_query_budget(self):
+        """It should read Items with one query each"""
+        wishlist = self._create_wishlists_with_items(1, 10)[0]
+        cache.clear()
+        with self.assertMaxQueries(1):
+            resp = self.app.get(f"{BASE_URL}/{wishlist.id}/items")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        item_id = resp.get_json()[0]["id"]
+        with self.assertMaxQueries(1):
+            resp = self.app.get(f"{BASE_URL}/{wishlist.id}/items/{item_id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_item_writes_query_budget(self):
+        """It should create, update, purchase and delete Items in a fixed number of queries"""
+        wishlist = self._create_wishlists(1)[0]
+        with self.assertMaxQueries(3):
+            resp = self.app.post(
+                f"{BASE_URL}/{wishlist.id}/items/bulk",
+                json=[item.serialize() for item in ItemFactory.create_batch(10)],
+            )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        with self.assertMaxQueries(6):
+            resp = self.app.post(f"{BASE_URL}/{wishlist.id}/items", json=ItemFactory().serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        data["name"] = "renamed"
+        with self.assertMaxQueries(4):
+            resp = self.app.put(f"{BASE_URL}/{wishlist.id}/items/{data['id']}", json=data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with self.assertMaxQueries(1):
+            resp = self.app.put(f"{BASE_URL}/{wishlist.id}/items/{data['id']}/purchase")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with self.assertMaxQueries(3):
+            resp = self.app.delete(f"{BASE_URL}/{wishlist.id}/items/{data['id']}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_query_budget_exceeded(self):
+        """It should fail and list the statements when a budget is exceeded"""
+        wishlist = self._create_wishlists(1)[0]
+        with self.assertRaises(AssertionError) as context:
+            with self.assertMaxQueries(0):
+                self.app.get(f"{BASE_URL}/{wishlist.id}")
+        self.assertIn("the budget is 0", str(context.exception))
+        self.assertIn("1. SELECT", str(context.exception))
@@ -0,0 +1,36 @@
+"""
+Test cases for the serialization micro-benchmarks
+
+"""
+import unittest
+from benchmarks.serialization import build_cases, measure, compare
+
+
+######################################################################
+#  S E R I A L I Z A T I O N   B E N C H M A R K   T E S T   C A S E S
+######################################################################
+class TestSerializationBenchmark(unittest.TestCase):
+    """ Test Cases for the serialization benchmarks """
+
+    def test_build_cases(self):
+        """ Every model method gets a case per list size """
+        cases = build_cases([1, 3])
+        self.assertEqual(len(cases), 8)
+        func, items = cases["wishlist_serialize[3]"]
+        self.assertEqual(items, 3)
+        self.assertEqual(len(func()["items"]), 3)
+        for func, _ in cases.values():
+            func()
+
+    def test_measure(self):
+        """ Time a callable per call and per item """
+        result = measure(lambda: None, items=10, repeat=3, min_time=0.001)
+        self.assertGreaterEqual(result["calls"], 1)
+        self.assertLessEqual(result["min_us"], result["median_us"])
+        self.assertAlmostEqual(result["per_item_ns"], result["median_us"] * 100, delta=1)
+
+    def test_compare(self):
+        """ Flag cases whose median slowed down beyond the threshold """
+        baseline = {"a": {"median_us": 10.0}, "b": {"median_us": 10.0}}
+        results = {"a": {"median_us": 10.5}, "b": {"median_us": 12.0}, "c": {"median_us": 1.0}}
+        self.assertEqual(compare(results, baseline, 0.10), ["b: median_us 10.0 -> 12.0"])